@@ -0,0 +1,76 @@
+import numpy
+
+# Installment calendars for loans. Loans carry no interest: a loan of value
+# in n installments owes value / n every period_days days from its start
+# date, the same price payment_update charges per installment, and its last
+# installment falls on end_date. Every function works on whole columns at
+# once, so the portfolio is computed in a handful of numpy operations.
+
+period_days = 30
+
+
+# Every installment of every loan, one row per installment:
+#   loan: position of the loan in the input columns
+#   installment: 1 to installments
+#   due_date: numpy datetime64[D]
+#   amount_due and cumulative_due: the plan, value / installments each
+#   amount_paid: the part of total_paid covering it, payments settle
+#   installments in order
+#   cumulative_paid and remaining_balance: total_paid applied up to it and
+#   what is left of the loan after it, the loan's total_left on the last one
+#   paid: whether total_paid covers it entirely
+def schedules(values, installments, start_dates, total_paid=None):
+    values = numpy.asarray(values, dtype=float)
+    installments = numpy.maximum(numpy.asarray(installments, dtype=int), 0)
+    start_dates = numpy.asarray(start_dates, dtype='datetime64[D]')
+
+    if total_paid is None:
+        total_paid = numpy.zeros(len(values))
+    else:
+        total_paid = numpy.asarray(total_paid, dtype=float)
+
+    loans = numpy.repeat(numpy.arange(len(values)), installments)
+    first_rows = numpy.cumsum(installments) - installments
+    numbers = numpy.arange(len(loans)) - first_rows[loans] + 1
+
+    value = values[loans]
+    count = installments[loans]
+    amount = value / count
+    paid_total = total_paid[loans]
+
+    # The last installment settles the loan exactly
+    cumulative = numpy.where(numbers == count, value, value * numbers / count)
+    cumulative_paid = numpy.clip(paid_total, 0, cumulative)
+    amount_paid = numpy.clip(paid_total - (cumulative - amount), 0, amount)
+
+    return {
+        'loan': loans,
+        'installment': numbers,
+        'due_date': start_dates[loans] + numbers * period_days,
+        'amount_due': amount,
+        'cumulative_due': cumulative,
+        'amount_paid': amount_paid,
+        'cumulative_paid': cumulative_paid,
+        'remaining_balance': value - cumulative_paid,
+        'paid': numpy.isclose(amount_paid, amount),
+    }
+
+
+# First day of month ('2025-03') and of the month after it
+def month_bounds(month):
+    month = numpy.datetime64(month, 'M')
+    return month.astype('datetime64[D]'), (month + 1).astype('datetime64[D]')
+
+
+# Installments due in [first, last) from schedules() rows
+def dues(rows, first, last):
+    due = (rows['due_date'] >= numpy.datetime64(first, 'D')) & (rows['due_date'] < numpy.datetime64(last, 'D'))
+    return {column: values[due] for column, values in rows.items()}
+
+
+# Rows as a list of dicts of Python values (due dates as datetime.date)
+def records(rows):
+    columns = list(rows)
+    values = [rows[column].tolist() for column in columns]
+
+    return [dict(zip(columns, row)) for row in zip(*values)]
@@ -1,15 +1,39 @@
 # System Libraries
 import os
+import logging
 import uuid
+import base64
+import binascii
 import datetime
+import itertools
+import re
+import numpy
 import pandas
 import time
+import click
 
 # Flask libraries
-from flask import Flask, request
+from flask import Flask, Response, request
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from flask_mongoengine import MongoEngine
 from flask_cors import CORS
+from dotenv import load_dotenv
 from mongoengine.errors import NotUniqueError, ValidationError
+from pymongo import ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Local modules
+import logs
+import metrics
+import generator
+import amortization
+import json_provider
+from cache import LRUCache
+from json_provider import json_date
+import monitoring
+from monitoring import CommandMonitor, PoolMonitor, SlowQueryLog
 
 ##################
 #
@@ -17,41 +41,191 @@ from mongoengine.errors import NotUniqueError, ValidationError
 #
 ##################
 
+# Settings are read from the environment (or a .env file)
+load_dotenv()
+
+
+def env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+read_preferences = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+
+# Connection pool counters, reported by /healthz
+pool_monitor = PoolMonitor()
+
+# Commands issued by each request, see monitoring.init_app
+command_monitor = CommandMonitor(observe=metrics.observe_command)
+
+
+# Runs explain() for the slow query log, on its own thread
+def explain_command(database, command):
+    return Company._get_db().client[database].command('explain', command, verbosity='queryPlanner')
+
+
+# Commands slower than SLOW_QUERY_MS, viewable at /admin/slow-queries
+slow_query_log = SlowQueryLog(
+    threshold_ms=env_int('SLOW_QUERY_MS', 100),
+    size=env_int('SLOW_QUERY_LOG_SIZE', 200),
+    explain=explain_command,
+    explain_sample=float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', '0.1')),
+)
+
+
+# MongoClient options shared by the sync (MongoEngine) and async clients
+def mongo_client_options():
+    options = {
+        'host': os.getenv('MONGODB_HOST', ''),
+        'port': env_int('MONGODB_PORT', 27017),
+        'maxPoolSize': env_int('MONGODB_MAX_POOL_SIZE', 100),
+        'minPoolSize': env_int('MONGODB_MIN_POOL_SIZE', 0),
+        'waitQueueTimeoutMS': env_int('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000),
+        'serverSelectionTimeoutMS': env_int('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'socketTimeoutMS': env_int('MONGODB_SOCKET_TIMEOUT_MS', 30000),
+        'read_preference': read_preferences[os.getenv('MONGODB_READ_PREFERENCE', 'primary')],
+        'event_listeners': [pool_monitor, command_monitor, slow_query_log],
+    }
+
+    # Comma separated, e.g. zstd,snappy,zlib
+    compressors = os.getenv('MONGODB_COMPRESSORS')
+    if compressors:
+        options['compressors'] = compressors
+
+    return options
+
+
 # Basic startup configuration
 app = Flask(__name__, static_folder='static')
 app.config['TEMPLATES_AUTO_RELOAD'] = True
-app.config['MONGODB_SETTINGS'] = {
-    'db': 'test',
-    'host': '',
-    'port': 27017,
-}
+app.config['MONGODB_SETTINGS'] = dict(
+    db=os.getenv('MONGODB_DB', 'test'),
+    **mongo_client_options(),
+)
+
+# Query budget per request (0 disables it); exceeding it logs a warning,
+# or fails the request when DB_QUERY_BUDGET_STRICT (default: testing) is set
+app.config['DB_QUERY_BUDGET'] = env_int('DB_QUERY_BUDGET', 0)
+app.config['DB_REPEATED_QUERY_LIMIT'] = env_int('DB_REPEATED_QUERY_LIMIT', 0)
+app.config['DB_QUERY_HEADERS'] = os.getenv('DB_QUERY_HEADERS', '').lower() in ('1', 'true', 'yes')
+if os.getenv('DB_QUERY_BUDGET_STRICT'):
+    app.config['DB_QUERY_BUDGET_STRICT'] = os.getenv('DB_QUERY_BUDGET_STRICT').lower() in ('1', 'true', 'yes')
+
+# Logging: LOG_LEVEL, per logger sampling of records below WARNING
+# (e.g. LOG_SAMPLING=app.payloads=0.01) and request/response bodies,
+# which are only logged (at DEBUG, on app.payloads) with LOG_PAYLOADS=1
+app.config['LOG_PAYLOADS'] = os.getenv('LOG_PAYLOADS', '').lower() in ('1', 'true', 'yes')
+logs.init_app(
+    app,
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    sampling=logs.parse_sampling(os.getenv('LOG_SAMPLING')),
+)
+logger = app.logger
+payload_logger = logging.getLogger('app.payloads')
+
+# JSON encoding: JSON_PROVIDER=orjson (the default when installed) or json
+json_provider.init_app(app, os.getenv('JSON_PROVIDER'))
+
 CORS(app)
+metrics.init_app(app)
+monitoring.init_app(app, observe_request=metrics.observe_request_commands)
 
 
 # Current salary
 current_minimum_wage = 1300000
 
 
+# Page sizes for list endpoints
+default_page_size = 100
+max_page_size = 1000
+
+# Documents fetched per round trip when streaming
+stream_batch_size = 500
+
+# Maximum number of records accepted by bulk endpoints
+max_bulk_size = 10000
+
+# Maximum number of open loans per employee
+max_loans_per_employee = 3
+
+# Weights of the nine NIT digits in the verification digit
+nit_weights = numpy.array([3, 1, 3, 1, 3, 1, 3, 1, 3])
+
+
+# Company documents cached in process by NIT and by id
+company_cache = LRUCache(maxsize=10000, ttl=300)
+
+
 # Initialize database
 db = MongoEngine(app)
 
 
+# Cache and pool counters are exported with the request metrics
+metrics.register_stats('company_cache', 'Company cache counters.', company_cache.stats)
+metrics.register_stats('mongodb_pool', 'MongoDB connection pool counters.', pool_monitor.stats)
+
+
 # Database Models
-class Company(db.Document):
+
+# Dates as stored: Documents built from request data still hold the
+# strings they were given, and new loans a datetime
+def document_date(document, field):
+    return raw_date(document._fields[field].to_mongo(document._data.get(field)))
+
+
+# The version changes on every save and is used to build ETags. Updates
+# increment it in the database, in the same write as the changes, so a save
+# never repeats a version an $inc elsewhere (loans, payments) produced; the
+# copy in memory is only an estimate afterwards.
+class VersionedDocument(db.Document):
+    version = db.IntField(default=0)
+
+    meta = {
+        'abstract': True,
+    }
+
+    def save(self, *args, **kwargs):
+        self.version = (self.version or 0) + 1
+        return super().save(*args, **kwargs)
+
+    def _get_update_doc(self):
+        update = super()._get_update_doc()
+
+        changes = update.get('$set', {})
+        changes.pop('version', None)
+        if not changes:
+            update.pop('$set', None)
+
+        update['$inc'] = {'version': 1}
+        return update
+
+
+class Company(VersionedDocument):
     NIT = db.StringField(unique=True)
     verification_digit = db.IntField()
     name = db.StringField(max_length=256)
     address = db.StringField(max_length=256)
 
-    def as_dict(self):
-        return {
+    # as_dict keys and the fields they are read from, for ?fields=
+    json_fields = {'NIT': 'NIT', 'name': 'name', 'address': 'address'}
+    json_references = {}
+
+    def as_dict(self, fields=None):
+        return select({
             "NIT": self.NIT,
             "name": self.name,
             "address": self.address
-        }
+        }, fields)
 
 
-class Employee(db.Document):
+class Employee(VersionedDocument):
     identification = db.IntField(unique=True)
     name = db.StringField()
     salary = db.FloatField()
@@ -60,19 +234,41 @@ class Employee(db.Document):
     company = db.ReferenceField(Company)
     current_loans = db.IntField()
 
-    def as_dict(self):
-        return {
+    meta = {
+        'indexes': ['company'],
+    }
+
+    json_fields = {
+        'identification': 'identification',
+        'name': 'name',
+        'salary': 'salary',
+        'hiring_date': 'hiring_date',
+        'birthdate': 'birthdate',
+        'company': 'company',
+        'current_loans': 'current_loans',
+    }
+    json_references = {'company': Company}
+
+    # fields: optional selection from requested_fields
+    def as_dict(self, fields=None):
+        data = select({
             'identification': self.identification,
             'name': self.name,
             'salary': self.salary,
-            'hiring_date': self.hiring_date,
-            'birthdate': self.birthdate,
-            'company': self.company.as_dict() if self.company else None,
+            'hiring_date': document_date(self, 'hiring_date'),
+            'birthdate': document_date(self, 'birthdate'),
             'current_loans': self.current_loans,
-        }
+        }, fields)
 
+        # The company is only looked up when it was requested
+        if selected(fields, 'company'):
+            company = cached_company(reference_id(self, 'company'))
+            data['company'] = company.as_dict(subfields(fields, 'company')) if company else None
 
-class Loan(db.Document):
+        return data
+
+
+class Loan(VersionedDocument):
     value = db.FloatField()
     installments = db.IntField()
     installments_paid = db.IntField()
@@ -82,18 +278,35 @@ class Loan(db.Document):
     end_date = db.DateField()
     employee = db.ReferenceField(Employee)
 
-    def as_dict(self):
-        return {
-            'id': str(self.id),
-            'value': self.value,
-            'installments': self.installments,
-            'installments_paid': self.installments_paid,
-            'total_paid': self.total_paid,
-            'payable_amount': self.total_left,
-            'start_date': self.start_date,
-            'end_date': self.end_date,
-            'employee': self.employee.as_dict()
-        }
+    # Ids of the /loans/payments batches applied to the loan
+    payment_batches = db.ListField(db.StringField())
+
+    meta = {
+        'indexes': ['employee', 'end_date'],
+    }
+
+    json_fields = {
+        'id': 'id',
+        'value': 'value',
+        'installments': 'installments',
+        'installments_paid': 'installments_paid',
+        'total_paid': 'total_paid',
+        'payable_amount': 'total_left',
+        'start_date': 'start_date',
+        'end_date': 'end_date',
+        'employee': 'employee',
+    }
+    json_references = {'employee': Employee}
+
+    # fields: optional selection from requested_fields
+    def as_dict(self, fields=None):
+        data = select(self.simple_dict(), fields)
+
+        if selected(fields, 'employee'):
+            employee = self.employee
+            data['employee'] = employee.as_dict(subfields(fields, 'employee')) if employee else None
+
+        return data
     
     def simple_dict(self):
         return {
@@ -103,8 +316,8 @@ class Loan(db.Document):
             'installments_paid': self.installments_paid,
             'total_paid': self.total_paid,
             'payable_amount': self.total_left,
-            'start_date': self.start_date,
-            'end_date': self.end_date,
+            'start_date': document_date(self, 'start_date'),
+            'end_date': document_date(self, 'end_date'),
         }
 
 ## Support Functions
@@ -132,6 +345,27 @@ def generate_vd(NIT):
                 vd = vd + 1
 
 
+# Nine ASCII digits (str.isdigit also accepts other scripts' digits)
+nit_pattern = re.compile('[0-9]{9}')
+
+
+# Vectorized generate_vd: returns the digits and a mask of well formed NITs
+def generate_vds(nits):
+    nits = [str(nit) for nit in nits]
+    valid = numpy.fromiter((nit_pattern.fullmatch(nit) is not None for nit in nits), dtype=bool, count=len(nits))
+    nits = numpy.asarray(nits, dtype=str)
+
+    # Read the ASCII digits of every valid NIT into a (n, 9) matrix
+    digits = numpy.zeros((len(nits), 9), dtype=numpy.int64)
+    ascii_nits = numpy.frombuffer(nits[valid].astype('S9').tobytes(), dtype=numpy.uint8)
+    digits[valid] = ascii_nits.reshape(-1, 9) - ord('0')
+
+    totals = digits @ nit_weights
+    verification_digits = (10 - totals % 10) % 10
+
+    return verification_digits, valid
+
+
 def calculate_age(birthdate):
     if not isinstance(birthdate, datetime.date):
         birthdate = datetime.datetime.strptime(birthdate, '%Y/%m/%d')
@@ -160,6 +394,22 @@ def calculate_salary(hiring_date):
     return salary
 
 
+# Vectorized versions of calculate_age / calculate_salary for pandas Series of dates
+def calculate_ages(birthdates, now=None):
+    now = now or datetime.datetime.now()
+    return (now - birthdates).dt.days / 360
+
+
+def calculate_salaries(hiring_dates, now=None):
+    now = now or datetime.datetime.now()
+    working_age = ((now - hiring_dates).dt.days / 360).fillna(0).astype(int)
+
+    # new employees cannot earn less than minimum wage
+    working_age = working_age.clip(lower=6)
+
+    return (working_age * current_minimum_wage) / 6
+
+
 def validate_employee(employee_data):
     identification = employee_data.get('identification', False)
     salary =  employee_data.get('salary', False)
@@ -201,8 +451,636 @@ def validate_employee(employee_data):
         }, 500
 
 
+# Cursors are the ObjectId of the last document on a page, base64 encoded
+def encode_cursor(object_id):
+    return base64.urlsafe_b64encode(object_id.binary).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padding = '=' * (-len(cursor) % 4)
+
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + padding))
+
+    except (binascii.Error, InvalidId, TypeError):
+        raise ValueError('Page cursor not valid.')
+
+
+# Unordered insert_many: one bad row does not stop the rest.
+# Returns {position in documents: error code} for the rows that failed.
+def insert_unordered(model, documents):
+    if not documents:
+        return {}
+
+    try:
+        model._get_collection().insert_many(documents, ordered=False)
+
+    except BulkWriteError as err:
+        return {error['index']: error.get('code') for error in err.details.get('writeErrors', [])}
+
+    return {}
+
+
+# insert_unordered over any iterable of documents, max_bulk_size at a time
+def insert_chunks(model, documents):
+    documents = iter(documents)
+    failed = 0
+
+    while True:
+        chunk = list(itertools.islice(documents, max_bulk_size))
+        if not chunk:
+            return failed
+
+        failed = failed + len(insert_unordered(model, chunk))
+
+
+# Validate NITs, compute verification digits and insert a batch of companies
+def import_companies(companies_data):
+    nits = [company_data.get('NIT') if isinstance(company_data, dict) else None for company_data in companies_data]
+    verification_digits, valid = generate_vds(nits)
+
+    results = []
+    documents = []
+    positions = []
+
+    rows = zip(companies_data, nits, verification_digits.tolist(), valid.tolist())
+
+    for index, (company_data, nit, verification_digit, is_valid) in enumerate(rows):
+        if not isinstance(company_data, dict):
+            error = 'Company data not valid.'
+        elif not is_valid:
+            error = 'Company NIT not valid.'
+        else:
+            error = None
+
+        if not error:
+            company = Company(
+                NIT=str(nit),
+                verification_digit=verification_digit,
+                name=company_data.get('name'),
+                address=company_data.get('address'),
+            )
+
+            # Field types and lengths, as save() would check them
+            try:
+                company.validate()
+
+            except ValidationError:
+                error = 'Company data not valid.'
+
+        if error:
+            results.append({
+                'index': index,
+                'result': f'Error: {error}'
+            })
+            continue
+
+        results.append({
+            'index': index,
+            'NIT': company.NIT,
+            'verification_digit': verification_digit,
+            'result': 'Company created successfully.'
+        })
+        documents.append(company.to_mongo().to_dict())
+        positions.append(len(results) - 1)
+
+    write_errors = insert_unordered(Company, documents)
+
+    for position, code in write_errors.items():
+        result = results[positions[position]]
+
+        if code == 11000:
+            result['result'] = 'Error: A company with the provided NIT already exists.'
+        else:
+            result['result'] = 'Error: Company could not be saved in the database.'
+
+    return results, len(documents) - len(write_errors)
+
+
+# Page size and starting _id from the ?limit= and ?after= arguments
+def page_arguments(args):
+    try:
+        limit = int(args.get('limit', default_page_size))
+
+    except ValueError:
+        raise ValueError('Page limit not valid.')
+
+    if limit < 1:
+        raise ValueError('Page limit not valid.')
+
+    after = args.get('after')
+
+    return min(limit, max_page_size), decode_cursor(after) if after else None
+
+
+# Keyset pagination on _id, driven by ?limit= and ?after=
+def paginate(queryset):
+    limit, after = page_arguments(request.args)
+
+    if after:
+        queryset = queryset.filter(id__gt=after)
+
+    # Fetch one extra document to know if there is a next page
+    page = list(queryset.order_by('id').limit(limit + 1))
+
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor(last['_id'] if isinstance(last, dict) else last.id)
+    else:
+        next_cursor = None
+
+    return page, next_cursor
+
+
+# Field selection for ?fields=name,salary,company.NIT: as_dict keys, with
+# nested keys for references, parsed to {'name': None, 'salary': None,
+# 'company': {'NIT': None}}. A None selection means every field.
+def field_selection(model, paths, prefix=''):
+    selection = {}
+    nested = {}
+
+    for path in paths:
+        key, _, rest = path.strip().partition('.')
+
+        if key not in model.json_fields or (rest and key not in model.json_references):
+            raise ValueError(f'Unknown field: {prefix}{path.strip()}')
+
+        if rest:
+            nested.setdefault(key, []).append(rest)
+        else:
+            selection[key] = None
+
+    # A whole reference wins over some of its fields
+    for key, rest in nested.items():
+        if key not in selection:
+            selection[key] = field_selection(model.json_references[key], rest, f'{prefix}{key}.')
+
+    return selection
+
+
+def requested_fields(model, args=None):
+    value = (request.args if args is None else args).get('fields')
+    return field_selection(model, value.split(',')) if value else None
+
+
+# Canonical form of a selection, e.g. for ETags
+def fields_key(fields, prefix=''):
+    return ','.join(sorted(
+        f'{prefix}{key}' if subselection is None else fields_key(subselection, f'{prefix}{key}.')
+        for key, subselection in fields.items()
+    ))
+
+
+def selected(fields, key):
+    return fields is None or key in fields
+
+
+def subfields(fields, key):
+    return None if fields is None else fields.get(key)
+
+
+def select(data, fields):
+    return data if fields is None else {key: value for key, value in data.items() if key in fields}
+
+
+# Document fields needed for a selection (the version is kept for ETags)
+def projection(model, fields):
+    return ['version'] + [model.json_fields[key] for key in fields]
+
+
+def project(queryset, fields):
+    return queryset if fields is None else queryset.only(*projection(queryset._document, fields))
+
+
+# Same projection for pymongo / the async driver
+def raw_projection(model, fields):
+    if fields is None:
+        return None
+
+    return {model._fields[name].db_field: 1 for name in projection(model, fields)}
+
+
+# Id of a referenced document, read without dereferencing it
+def reference_id(document, field):
+    reference = document._data.get(field)
+    return getattr(reference, 'id', reference)
+
+
+# Read-through Company lookups. Cached documents are shared between
+# requests, so they must only be read; updates load a fresh copy.
+def cache_company(company):
+    company_cache.set(('NIT', company.NIT), company)
+    company_cache.set(('id', company.id), company)
+
+
+def invalidate_company(company):
+    company_cache.pop(('NIT', company.NIT))
+    company_cache.pop(('id', company.id))
+
+
+def cached_company(company_id):
+    if company_id is None:
+        return None
+
+    company = company_cache.get(('id', company_id))
+
+    if company is None:
+        company = Company.objects.filter(id=company_id).first()
+        if company:
+            cache_company(company)
+
+    return company
+
+
+def cached_company_by_nit(nit):
+    company = company_cache.get(('NIT', str(nit)))
+
+    if company is None:
+        company = Company.objects.filter(NIT=str(nit)).first()
+        if company:
+            cache_company(company)
+
+    return company
+
+
+# Companies by id: cache hits first, one $in query for the rest
+def cached_companies(company_ids):
+    companies = {}
+    missing = []
+
+    for company_id in company_ids:
+        company = company_cache.get(('id', company_id))
+
+        if company is None:
+            missing.append(company_id)
+        else:
+            companies[company_id] = company
+
+    if missing:
+        for company in Company.objects(id__in=missing):
+            cache_company(company)
+            companies[company.id] = company
+
+    return companies
+
+
+# Installments and optional amount of a loan payment
+def parse_payment(payment_data):
+    installments = int(payment_data.get('installments') or 0)
+    amount = payment_data.get('amount')
+    amount = float(amount) if amount else None
+
+    if installments < 0 or (amount is not None and amount < 0):
+        raise ValueError('Payment data not valid.')
+
+    return installments, amount
+
+
+# Atomic update applying a payment. Without an amount the installments are
+# priced from the loan itself (value / installments) in an update pipeline.
+def payment_update(installments, amount=None):
+    if amount:
+        return {
+            '$inc': {
+                'installments_paid': installments,
+                'total_paid': amount,
+                'total_left': -amount,
+                'version': 1,
+            }
+        }
+
+    amount = {'$multiply': [{'$divide': ['$value', '$installments']}, installments]}
+
+    return [{
+        '$set': {
+            'installments_paid': {'$add': [{'$ifNull': ['$installments_paid', 0]}, installments]},
+            'total_paid': {'$add': [{'$ifNull': ['$total_paid', 0]}, amount]},
+            'total_left': {'$subtract': ['$total_left', amount]},
+            'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]},
+        }
+    }]
+
+
+# Request / response bodies, skipped entirely unless LOG_PAYLOADS is set
+def log_payload(message, payload):
+    if app.config['LOG_PAYLOADS'] and payload_logger.isEnabledFor(logging.DEBUG):
+        payload_logger.debug(message, extra={'payload': payload})
+
+
+# Strong ETag built from the (id, version) of every document in a response
+def make_etag(*versions):
+    return '-'.join(f'{document_id}.{version or 0}' for document_id, version in versions)
+
+
+# Responses trimmed with ?fields= are a different representation
+def fields_etag(etag, fields):
+    return etag if fields is None else f'{etag};{fields_key(fields)}'
+
+
+def etag_headers(etag):
+    return {
+        'ETag': f'"{etag}"'
+    }
+
+
+# Versions needed for an employee ETag, read with a projection only
+def employee_versions(employee_id=None, identification=None):
+    query = {'id': employee_id} if employee_id else {'identification': identification}
+    record = Employee.objects(**query).only('version', 'company').as_pymongo().first()
+
+    if not record:
+        return None
+
+    company = cached_company(record.get('company'))
+
+    return [
+        (record['_id'], record.get('version')),
+        (company.id, company.version) if company else (None, None),
+    ]
+
+
+# Serializers for raw documents (from as_pymongo or the async driver),
+# producing the same JSON as the as_dict methods
+def raw_date(value):
+    return json_date(value.date() if isinstance(value, datetime.datetime) else value)
+
+
+def raw_company_dict(company, fields=None):
+    return select({
+        'NIT': company.get('NIT'),
+        'name': company.get('name'),
+        'address': company.get('address')
+    }, fields)
+
+
+def raw_employee_dict(employee, companies, fields=None):
+    data = select({
+        'identification': employee.get('identification'),
+        'name': employee.get('name'),
+        'salary': employee.get('salary'),
+        'hiring_date': raw_date(employee.get('hiring_date')),
+        'birthdate': raw_date(employee.get('birthdate')),
+        'current_loans': employee.get('current_loans'),
+    }, fields)
+
+    if selected(fields, 'company'):
+        company = companies.get(employee.get('company'))
+        data['company'] = raw_company_dict(company, subfields(fields, 'company')) if company else None
+
+    return data
+
+
+def raw_loan_simple_dict(loan, fields=None):
+    return select({
+        'id': str(loan['_id']),
+        'value': loan.get('value'),
+        'installments': loan.get('installments'),
+        'installments_paid': loan.get('installments_paid'),
+        'total_paid': loan.get('total_paid', 0),
+        'payable_amount': loan.get('total_left'),
+        'start_date': raw_date(loan.get('start_date')),
+        'end_date': raw_date(loan.get('end_date')),
+    }, fields)
+
+
+def raw_loan_dict(loan, employees, companies, fields=None):
+    loan_dict = raw_loan_simple_dict(loan, fields)
+
+    if selected(fields, 'employee'):
+        employee = employees.get(loan.get('employee'))
+        loan_dict['employee'] = raw_employee_dict(employee, companies, subfields(fields, 'employee')) if employee else None
+
+    return loan_dict
+
+
+# Raw read path: as_pymongo() records and the raw_* serializers, without
+# building Documents, in a constant number of queries regardless of page
+# size. Companies still come from the cache, as their _data.
+def raw_reference_ids(records, field):
+    ids = {record.get(field) for record in records}
+    ids.discard(None)
+
+    return list(ids)
+
+
+def raw_cached_companies(records):
+    companies = cached_companies(raw_reference_ids(records, 'company'))
+    return {company_id: company._data for company_id, company in companies.items()}
+
+
+def raw_companies_as_dicts(records, fields=None):
+    return [raw_company_dict(record, fields) for record in records]
+
+
+def raw_employees_as_dicts(records, fields=None):
+    companies = raw_cached_companies(records) if selected(fields, 'company') else {}
+    return [raw_employee_dict(record, companies, fields) for record in records]
+
+
+def raw_loans_as_dicts(records, fields=None):
+    loans = [raw_loan_simple_dict(record, fields) for record in records]
+
+    if not selected(fields, 'employee'):
+        return loans
+
+    employee_fields = subfields(fields, 'employee')
+    employees = project(Employee.objects(id__in=raw_reference_ids(records, 'employee')), employee_fields).as_pymongo()
+    employees = list(employees)
+
+    companies = raw_cached_companies(employees) if selected(employee_fields, 'company') else {}
+    employee_dicts = {employee['_id']: raw_employee_dict(employee, companies, employee_fields) for employee in employees}
+
+    for loan, record in zip(loans, records):
+        loan['employee'] = employee_dicts.get(record.get('employee'))
+
+    return loans
+
+
+# Streaming is requested with ?stream=1 or Accept: application/x-ndjson
+def wants_stream():
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+
+# Stream a whole collection as NDJSON, one serialized batch at a time
+def stream_records(queryset, serializer):
+    after = request.args.get('after')
+    if after:
+        queryset = queryset.filter(id__gt=decode_cursor(after))
+
+    cursor = queryset.order_by('id').no_cache().batch_size(stream_batch_size)
+
+    def generate():
+        # A plain generator, since re-iterating a queryset rewinds it
+        documents = (document for document in cursor)
+
+        while True:
+            batch = list(itertools.islice(documents, stream_batch_size))
+            if not batch:
+                return
+
+            for record in serializer(batch):
+                yield app.json.dumps(record) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+# Load employees (and their outstanding loans) into a DataFrame and compute
+# seniority, salary and age for every row at once.
+# loans defaults to the loans of the loaded employees.
+def payroll_frame(employees, loans=None):
+    fields = ['identification', 'name', 'hiring_date', 'birthdate', 'company']
+    records = employees.only(*fields).as_pymongo()
+
+    frame = pandas.DataFrame.from_records(list(records), columns=['_id'] + fields)
+    frame['hiring_date'] = pandas.to_datetime(frame['hiring_date'])
+    frame['birthdate'] = pandas.to_datetime(frame['birthdate'])
+
+    now = datetime.datetime.now()
+    frame['seniority'] = ((now - frame['hiring_date']).dt.days / 360).fillna(0).astype(int)
+    frame['salary'] = calculate_salaries(frame['hiring_date'], now)
+    frame['age'] = calculate_ages(frame['birthdate'], now)
+
+    if loans is None:
+        loans = Loan.objects(employee__in=frame['_id'].tolist())
+
+    loan_records = loans.only('employee', 'total_left').as_pymongo()
+    loans_frame = pandas.DataFrame.from_records(list(loan_records), columns=['employee', 'total_left'])
+    outstanding = loans_frame.groupby('employee')['total_left'].sum()
+    frame['outstanding_loans'] = frame['_id'].map(outstanding).fillna(0)
+
+    return frame
+
+
+# Per company rollups of a payroll frame, indexed by company id
+def payroll_summaries(frame):
+    return frame.groupby('company').agg(
+        headcount=('identification', 'size'),
+        total_salary=('salary', 'sum'),
+        average_salary=('salary', 'mean'),
+        average_age=('age', 'mean'),
+        average_seniority=('seniority', 'mean'),
+        outstanding_loans=('outstanding_loans', 'sum'),
+    )
+
+
+# DataFrame rows as JSON ready dicts (NaN becomes None)
+def frame_records(frame):
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+# Company rollups computed by MongoDB: headcount, payroll, average age and
+# outstanding loans for the companies of the matching employees
+def aggregate_company_stats(employees):
+    now = datetime.datetime.now()
+    ms_per_year = 1000 * 60 * 60 * 24 * 360
+
+    pipeline = [
+        {'$lookup': {
+            'from': Loan._get_collection_name(),
+            'localField': '_id',
+            'foreignField': 'employee',
+            'as': 'loans',
+        }},
+        {'$group': {
+            '_id': '$company',
+            'headcount': {'$sum': 1},
+            'total_salary': {'$sum': '$salary'},
+            'average_salary': {'$avg': '$salary'},
+            'age': {'$avg': {'$subtract': [now, '$birthdate']}},
+            'loans': {'$sum': {'$size': '$loans'}},
+            'outstanding_loans': {'$sum': {'$sum': '$loans.total_left'}},
+        }},
+        {'$lookup': {
+            'from': Company._get_collection_name(),
+            'localField': '_id',
+            'foreignField': '_id',
+            'as': 'company',
+        }},
+        {'$unwind': '$company'},
+        {'$project': {
+            '_id': 0,
+            'NIT': '$company.NIT',
+            'name': '$company.name',
+            'headcount': 1,
+            'total_salary': 1,
+            'average_salary': 1,
+            'average_age': {'$divide': ['$age', ms_per_year]},
+            'loans': 1,
+            'outstanding_loans': 1,
+        }},
+        {'$sort': {'NIT': 1}},
+    ]
+
+    return list(employees.aggregate(pipeline))
+
+
 ## API Endpoints
 
+# Endpoint for health checks: database round trip and pool statistics
+@app.route('/healthz', methods=['GET'])
+def healthz():
+
+    try:
+        start = time.perf_counter()
+        Company._get_db().command('ping')
+        ping_ms = (time.perf_counter() - start) * 1000
+
+        return {
+            'result': 'success',
+            'database': 'ok',
+            'ping_ms': ping_ms,
+            'pool': pool_monitor.stats()
+        }, 200
+
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Database is not reachable.',
+            'database': 'error',
+            'pool': pool_monitor.stats()
+        }, 503
+
+
+# Endpoint for Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
+# Endpoint for the most recent slow queries, newest first
+@app.route('/admin/slow-queries', methods=['GET'])
+def slow_queries():
+
+    entries = slow_query_log.recent()
+
+    # ?collscan=1 keeps only queries explained as collection scans
+    if request.args.get('collscan'):
+        entries = [entry for entry in entries if entry['collscan']]
+
+    return {
+        'result': 'success',
+        'threshold_ms': slow_query_log.threshold_ms,
+        'slow_queries': entries
+    }, 200
+
+
+# Endpoint to empty the slow query log
+@app.route('/admin/slow-queries/clear', methods=['POST'])
+def clear_slow_queries():
+
+    slow_query_log.clear()
+
+    return {
+        'result': 'Slow query log cleared.'
+    }, 200
+
+
 #####
 #
 # Company Endpoints
@@ -212,16 +1090,28 @@ def validate_employee(employee_data):
 # Endpoint to get data for all companies
 @app.route('/companies/', methods=['GET'])
 def list_companies():
-    
+
     try:
-        companies_data = Company.objects.all()
-        companies = [company.as_dict() for company in companies_data]
+        fields = requested_fields(Company)
+        queryset = project(Company.objects, fields).as_pymongo()
+
+        if wants_stream():
+            return stream_records(queryset, lambda batch: raw_companies_as_dicts(batch, fields=fields))
+
+        companies_data, next_cursor = paginate(queryset)
+        companies = raw_companies_as_dicts(companies_data, fields=fields)
 
         return {
             'result': 'success',
-            'companies': companies
+            'companies': companies,
+            'next_cursor': next_cursor
         }, 200
-    
+
+    except ValueError as err:
+        return {
+            'result': f'Error: {err}'
+        }, 400
+
     except Exception:
         return {
             'result': 'An error has occured.'
@@ -235,16 +1125,31 @@ def company(nit):
 
     # Read
     if request.method == 'GET':
-        # Search NIT in database
-        result = Company.objects.filter(NIT=str(nit)).first()
+        try:
+            fields = requested_fields(Company)
+
+        except ValueError as err:
+            return {
+                'result': f'Error: {err}'
+            }, 400
+
+        # Search NIT in cache / database
+        result = cached_company_by_nit(nit)
 
         # Return results accordingly
         if result:
-            print(result.as_dict())
+            etag = fields_etag(make_etag((result.id, result.version)), fields)
+
+            if etag in request.if_none_match:
+                return '', 304, etag_headers(etag)
+
+            company = result.as_dict(fields)
+            log_payload('company', company)
+
             return {
                 'result': 'success',
-                'company': result.as_dict()
-            }, 200
+                'company': company
+            }, 200, etag_headers(etag)
 
         else:
             return {
@@ -258,6 +1163,8 @@ def company(nit):
         if company:
             company_data = request.get_json()
             
+            old_nit = company.NIT
+
             # Update company information
             try:
                 nit = company_data.get('NIT', False)
@@ -271,6 +1178,10 @@ def company(nit):
 
                 company.save()
 
+                # Drop both the old and the new NIT from the cache
+                company_cache.pop(('NIT', old_nit))
+                invalidate_company(company)
+
                 return {
                     'result': 'Company information updated successfully.',
                     'company_data': company.as_dict()
@@ -281,60 +1192,227 @@ def company(nit):
                     'result': 'Error: Employee data not valid.'
                 }, 500
 
-            except Exception as err:
-                print(err)
-                return {
-                    'result': 'Error: Could not update company information.'
-                }, 500
+            except Exception as err:
+                logger.exception(err)
+                return {
+                    'result': 'Error: Could not update company information.'
+                }, 500
+
+        else:
+            return {
+                'result': 'Error: Company ID is not in the database.'
+            }, 400
+
+
+# Endpoint to create a new company
+@app.route('/company/', methods=['POST'])
+def new_company():
+
+    if request.get_json():
+        company_data = request.get_json()
+    else:
+        return {
+            'result': 'Error: Company data not received.'
+        }, 400
+
+    # Check if data was sent
+    if not company_data:
+        return {
+            'result': 'Error: Company data not received.'
+        }, 400
+
+    else:
+        try:
+            # Calculate validation digit
+            verification_digit = generate_vd(company_data.get('NIT', False))
+            company_data['verification_digit'] = verification_digit
+
+            # Save
+            company = Company(**company_data)
+            company.save()
+            invalidate_company(company)
+
+            return {
+                'result': 'success',
+                'company_data': company.as_dict()
+            }, 200
+
+        except NotUniqueError:
+            return {
+                'result': 'Error: A company with the provided NIT already exists.'
+            }, 400
+
+        except Exception as err:
+            logger.exception(err)
+            return {
+                'result': 'Error: Company could not be saved in the database.'
+            }, 500
+
+
+# Endpoint to create many companies in one request
+@app.route('/companies/bulk', methods=['POST'])
+def bulk_companies():
+
+    request_data = request.get_json(silent=True)
+    companies_data = request_data.get('data') if isinstance(request_data, dict) else None
+
+    # Check if data was sent
+    if not companies_data or not isinstance(companies_data, list):
+        return {
+            'result': 'Error: Company data not received.'
+        }, 400
+
+    if len(companies_data) > max_bulk_size:
+        return {
+            'result': f'Error: At most {max_bulk_size} companies can be created per request.'
+        }, 400
+
+    try:
+        results, created = import_companies(companies_data)
+
+        return {
+            'result': 'success',
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        }, 200
+
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Companies could not be saved in the database.'
+        }, 500
+
+
+# Endpoint for a company payroll report
+@app.route('/company/<nit>/payroll', methods=['GET'])
+def company_payroll(nit):
+
+    # Search NIT in database
+    company = Company.objects.filter(NIT=str(nit)).first()
+
+    if not company:
+        return {
+            'result': 'Error: Company ID is not in the database.'
+        }, 400
+
+    try:
+        frame = payroll_frame(Employee.objects(company=company))
+        summaries = frame_records(payroll_summaries(frame))
+        summary = summaries[0] if summaries else {
+            'headcount': 0,
+            'total_salary': 0,
+            'average_salary': None,
+            'average_age': None,
+            'average_seniority': None,
+            'outstanding_loans': 0,
+        }
+
+        columns = ['identification', 'name', 'seniority', 'salary', 'age', 'outstanding_loans']
+
+        return {
+            'result': 'success',
+            'company': company.as_dict(),
+            'summary': summary,
+            'employees': frame_records(frame[columns])
+        }, 200
+
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Could not calculate company payroll.'
+        }, 500
+
+
+# Endpoint for the payroll summary of every company
+@app.route('/companies/payroll', methods=['GET'])
+def companies_payroll():
+
+    try:
+        frame = payroll_frame(Employee.objects(company__ne=None), Loan.objects)
+        summaries = payroll_summaries(frame)
+
+        companies = Company.objects(id__in=summaries.index.tolist()).only('NIT', 'name', 'address')
+        companies = {company.id: company.as_dict() for company in companies}
 
-        else:
-            return {
-                'result': 'Error: Company ID is not in the database.'
-            }, 400
+        results = []
+        for company_id, summary in zip(summaries.index, frame_records(summaries)):
+            if company_id in companies:
+                results.append(dict(companies[company_id], **summary))
 
+        return {
+            'result': 'success',
+            'companies': results
+        }, 200
 
-# Endpoint to create a new company
-@app.route('/company/', methods=['POST'])
-def new_company():
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Could not calculate company payroll.'
+        }, 500
 
-    if request.get_json():
-        company_data = request.get_json()
-    else:
+
+# Endpoint for the rollups of a company
+@app.route('/company/<nit>/stats', methods=['GET'])
+def company_stats(nit):
+
+    # Search NIT in database
+    company = Company.objects.filter(NIT=str(nit)).first()
+
+    if not company:
         return {
-            'result': 'Error: Company data not received.'
+            'result': 'Error: Company ID is not in the database.'
         }, 400
 
-    # Check if data was sent
-    if not company_data:
+    try:
+        stats = aggregate_company_stats(Employee.objects(company=company))
+
         return {
-            'result': 'Error: Company data not received.'
-        }, 400
+            'result': 'success',
+            'stats': stats[0] if stats else {
+                'NIT': company.NIT,
+                'name': company.name,
+                'headcount': 0,
+                'total_salary': 0,
+                'average_salary': None,
+                'average_age': None,
+                'loans': 0,
+                'outstanding_loans': 0,
+            }
+        }, 200
 
-    else:
-        try:
-            # Calculate validation digit
-            verification_digit = generate_vd(company_data.get('NIT', False))
-            company_data['verification_digit'] = verification_digit
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Could not calculate company stats.'
+        }, 500
 
-            # Save
-            company = Company(**company_data)
-            company.save()
 
-            return {
-                'result': 'success',
-                'company_data': company.as_dict()
-            }, 200
+# Endpoint for the rollups of every company
+@app.route('/companies/stats', methods=['GET'])
+def companies_stats():
 
-        except NotUniqueError:
-            return {
-                'result': 'Error: A company with the provided NIT already exists.'
-            }, 400
+    try:
+        return {
+            'result': 'success',
+            'companies': aggregate_company_stats(Employee.objects(company__ne=None))
+        }, 200
 
-        except Exception as err:
-            print(err)
-            return {
-                'result': 'Error: Company could not be saved in the database.'
-            }, 500
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Could not calculate company stats.'
+        }, 500
+
+
+# Endpoint for company cache counters
+@app.route('/companies/cache', methods=['GET'])
+def company_cache_stats():
+
+    return {
+        'result': 'success',
+        'cache': company_cache.stats()
+    }, 200
 
 
 # Endpoint to delete a company
@@ -348,12 +1426,14 @@ def delete_company(nit):
     if result:
         try:
             result.delete()
+            invalidate_company(result)
+
             return {
                 'result': 'Company deleted successfully.',
             }, 200
         
         except Exception as err:
-            print(err)
+            logger.exception(err)
             return {
                 'result': 'Error: Could not delete company information.'
             }, 500
@@ -373,18 +1453,30 @@ def delete_company(nit):
 # Endpoint to get data for all employees
 @app.route('/employees/', methods=['GET'])
 def list_employees():
-    
+
     try:
-        employee_data = Employee.objects.all()
-        employees = [employee.as_dict() for employee in employee_data]
+        fields = requested_fields(Employee)
+        queryset = project(Employee.objects, fields).as_pymongo()
 
-        print(employees)
+        if wants_stream():
+            return stream_records(queryset, lambda batch: raw_employees_as_dicts(batch, fields=fields))
+
+        employee_data, next_cursor = paginate(queryset)
+        employees = raw_employees_as_dicts(employee_data, fields=fields)
+
+        log_payload('employees', employees)
 
         return {
             'result': 'success',
-            'employees': employees
+            'employees': employees,
+            'next_cursor': next_cursor
         }, 200
-    
+
+    except ValueError as err:
+        return {
+            'result': f'Error: {err}'
+        }, 400
+
     except Exception:
         return {
             'result': 'An error has occurred.'
@@ -397,12 +1489,29 @@ def employee(id):
 
     # Read
     if request.method == 'GET':
+        try:
+            fields = requested_fields(Employee)
+
+        except ValueError as err:
+            return {
+                'result': f'Error: {err}'
+            }, 400
+
+        # Check the client's version before loading the full document
+        versions = employee_versions(identification=id)
+
+        if versions:
+            etag = fields_etag(make_etag(*versions), fields)
+
+            if etag in request.if_none_match:
+                return '', 304, etag_headers(etag)
+
         # Search NIT in database
-        result = Employee.objects.filter(identification=id).first()
+        result = project(Employee.objects.filter(identification=id), fields).as_pymongo().first() if versions else None
 
         # Return results accordingly
         if result:
-            return result.as_dict()
+            return raw_employees_as_dicts([result], fields)[0], 200, etag_headers(etag)
 
         else:
             return {
@@ -455,7 +1564,7 @@ def employee(id):
                 }, 200
 
             except Exception as err:
-                print(err)
+                logger.exception(err)
                 return {
                     'result': 'Error: Could not update employee information.'
                 }, 500
@@ -471,7 +1580,7 @@ def employee(id):
 @app.route('/employee/', methods=['POST'])
 def new_employee():
 
-    print(request.get_json()) # debug
+    log_payload('request', request.get_json(silent=True))
     if request.get_json():
         employee_data = request.get_json()['data']
     else:
@@ -489,7 +1598,7 @@ def new_employee():
         try:
             validate_employee(employee_data)
 
-            company = Company.objects.filter(NIT=employee_data.get('company')).first()
+            company = cached_company_by_nit(employee_data.get('company'))
             if company:
                 employee_data['company'] = company
             else:
@@ -528,12 +1637,139 @@ def new_employee():
             }, 400
 
         except Exception as err:
-            print(err)
+            logger.exception(err)
             return {
                 'result': 'Error: Employee could not be saved in the database.'
             }, 500
 
 
+# Endpoint to create many employees in one request
+@app.route('/employees/bulk', methods=['POST'])
+def bulk_employees():
+
+    request_data = request.get_json(silent=True)
+    employees_data = request_data.get('data') if isinstance(request_data, dict) else None
+
+    # Check if data was sent
+    if not employees_data or not isinstance(employees_data, list):
+        return {
+            'result': 'Error: Employee data not received.'
+        }, 400
+
+    if len(employees_data) > max_bulk_size:
+        return {
+            'result': f'Error: At most {max_bulk_size} employees can be created per request.'
+        }, 400
+
+    try:
+        frame = pandas.DataFrame.from_records(
+            [row if isinstance(row, dict) else {} for row in employees_data],
+            columns=['identification', 'name', 'hiring_date', 'birthdate', 'company'],
+        )
+
+        # Parse and compute the whole batch at once
+        now = datetime.datetime.now()
+        identifications = pandas.to_numeric(frame['identification'], errors='coerce')
+        hiring_dates = pandas.to_datetime(frame['hiring_date'], format='%Y/%m/%d', errors='coerce')
+        birthdates = pandas.to_datetime(frame['birthdate'], format='%Y/%m/%d', errors='coerce')
+        salaries = calculate_salaries(hiring_dates, now)
+        ages = calculate_ages(birthdates, now)
+
+        # Resolve every company NIT with a single query
+        nits = [str(nit) for nit in frame['company'].dropna().unique()]
+        companies = {company.NIT: company.id for company in Company.objects(NIT__in=nits).only('NIT')}
+
+        rows = zip(
+            employees_data,
+            identifications.tolist(),
+            hiring_dates.tolist(),
+            birthdates.tolist(),
+            salaries.tolist(),
+            ages.tolist(),
+        )
+
+        results = []
+        documents = []
+        positions = []
+
+        for index, (employee_data, identification, hiring_date, birthdate, salary, age) in enumerate(rows):
+            if not isinstance(employee_data, dict):
+                error = 'Employee data not valid.'
+            elif pandas.isna(identification):
+                error = 'Employee identification not valid.'
+            elif pandas.isna(hiring_date):
+                error = 'Employee hiring date not valid.'
+            elif pandas.isna(birthdate):
+                error = 'Employee birth date not valid.'
+            elif age > 70:
+                error = 'Employee exceeds maximum allowed age.'
+            elif age < 18:
+                error = 'Employee is below minimum allowed age.'
+            else:
+                error = None
+
+            if error:
+                results.append({
+                    'index': index,
+                    'result': f'Error: {error}'
+                })
+                continue
+
+            employee = Employee(
+                identification=int(identification),
+                name=employee_data.get('name'),
+                salary=salary,
+                hiring_date=hiring_date.date(),
+                birthdate=birthdate.date(),
+                company=companies.get(str(employee_data.get('company'))),
+                current_loans=0,
+            )
+
+            # Field types and lengths, as save() would check them
+            try:
+                employee.validate()
+
+            except ValidationError:
+                results.append({
+                    'index': index,
+                    'result': 'Error: Employee data not valid.'
+                })
+                continue
+
+            results.append({
+                'index': index,
+                'identification': employee.identification,
+                'result': 'Employee created successfully.'
+            })
+            documents.append(employee.to_mongo().to_dict())
+            positions.append(len(results) - 1)
+
+        write_errors = insert_unordered(Employee, documents)
+
+        for position, code in write_errors.items():
+            result = results[positions[position]]
+
+            if code == 11000:
+                result['result'] = 'Error: An employee with the provided ID already exists.'
+            else:
+                result['result'] = 'Error: Employee could not be saved in the database.'
+
+        created = len(documents) - len(write_errors)
+
+        return {
+            'result': 'success',
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        }, 200
+
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Employees could not be saved in the database.'
+        }, 500
+
+
 # Endpoint to delete a employee
 @app.route('/employee/<int:identification>/delete', methods=['POST'])
 def delete_employee(identification):
@@ -550,7 +1786,7 @@ def delete_employee(identification):
             }, 200
         
         except Exception as err:
-            print(err)
+            logger.exception(err)
             return {
                 'result': 'Error: Could not delete employee information.'
             }, 500
@@ -570,9 +1806,11 @@ def employee_company(identification):
 
     # Perform deletion as requested
     if employee:
-        if employee.company:
+        company = cached_company(reference_id(employee, 'company'))
+
+        if company:
             return {
-                    'company': employee.company.as_dict(),
+                    'company': company.as_dict(),
                 }, 200
         
         else:
@@ -612,16 +1850,16 @@ def employee_age(identification):
 def employee_loans(identification):
 
     # Search NIT in database
-    employee = Employee.objects.filter(identification=identification).first()
+    employee = Employee.objects.filter(identification=identification).only('id').as_pymongo().first()
 
     # Perform deletion as requested
     if employee:
-        loans = Loan.objects.filter(employee=employee)
+        loans = Loan.objects.filter(employee=employee['_id']).as_pymongo()
 
         results = []
 
         for loan in loans:
-            results.append(loan.simple_dict())
+            results.append(raw_loan_simple_dict(loan))
 
         return {
             'result': results
@@ -642,16 +1880,28 @@ def employee_loans(identification):
 # Endpoint to get data for all loans
 @app.route('/loans/', methods=['GET'])
 def list_loans():
-    
+
     try:
-        loans_data = Loan.objects.all()
-        loans = [loan.as_dict() for loan in loans_data]
+        fields = requested_fields(Loan)
+        queryset = project(Loan.objects, fields).as_pymongo()
+
+        if wants_stream():
+            return stream_records(queryset, lambda batch: raw_loans_as_dicts(batch, fields=fields))
+
+        loans_data, next_cursor = paginate(queryset)
+        loans = raw_loans_as_dicts(loans_data, fields=fields)
 
         return {
             'result': 'success',
-            'loans': loans
+            'loans': loans,
+            'next_cursor': next_cursor
         }, 200
-    
+
+    except ValueError as err:
+        return {
+            'result': f'Error: {err}'
+        }, 400
+
     except Exception:
         return {
             'result': 'An error has occurred.'
@@ -664,11 +1914,31 @@ def loan_data(id):
     if request.method == 'GET':
         # Search NIT in database
         try:
-            result = Loan.objects.filter(id=id).first()
+            fields = requested_fields(Loan)
+
+        except ValueError as err:
+            return {
+                'result': f'Error: {err}'
+            }, 400
+
+        try:
+            # Check the client's version before loading the full document
+            record = Loan.objects(id=id).only('version', 'employee').as_pymongo().first()
+
+            if record:
+                # Loans of deleted employees keep an empty employee part
+                versions = employee_versions(employee_id=record['employee']) if record.get('employee') else None
+                versions = versions or [(None, None), (None, None)]
+                etag = fields_etag(make_etag((record['_id'], record.get('version')), *versions), fields)
+
+                if etag in request.if_none_match:
+                    return '', 304, etag_headers(etag)
+
+            result = project(Loan.objects.filter(id=id), fields).as_pymongo().first() if record else None
 
             # Return results accordingly
             if result:
-                return result.as_dict()
+                return raw_loans_as_dicts([result], fields)[0], 200, etag_headers(etag)
 
             else:
                 return {
@@ -682,47 +1952,202 @@ def loan_data(id):
     
     else:
         try:
-            loan = Loan.objects.filter(id=id).first()
+            installments, amount = parse_payment(request.json.get('data') or {})
 
-            if loan:
-                loan_data = request.json.get('data', False)
-                installments = loan_data.get('installments')
-                amount = loan_data.get('amount')
-
-                if installments:
-                    loan.installments_paid = loan.installments_paid + installments
-                
-                    if amount:
-                        loan.total_paid = loan.total_paid + amount
-                    else:
-                        amount = (loan.value / loan.installments) * installments
-                        loan.total_paid = loan.total_paid + amount
+        except (TypeError, ValueError, AttributeError):
+            return {
+                'result': 'Error: Payment data not valid.'
+            }, 400
 
-                loan.save()
+        try:
+            loans = Loan._get_collection()
+
+            # Apply the payment and read the new state in the same operation
+            if installments:
+                loan = loans.find_one_and_update(
+                    {'_id': ObjectId(id), 'total_left': {'$gt': 0}},
+                    payment_update(installments, amount),
+                    return_document=ReturnDocument.AFTER,
+                )
+            else:
+                loan = loans.find_one({'_id': ObjectId(id)})
 
+            if loan:
                 return {
                     'result': 'Loan updated successfully.',
-                    'loan_data': loan.as_dict()
+                    'loan_data': Loan._from_son(loan).as_dict()
                 }, 200
 
+            elif Loan.objects(id=id).count():
+                return {
+                    'result': 'Error: Loan is already fully paid.'
+                }, 400
+
             else:
                 return {
                     'result': 'Error: Loan does not exist in the database.'
                 }, 400
-            
+
+        except InvalidId:
+            return {
+                'result': 'Error: Loan ID not valid.'
+            }, 400
+
         except Exception as err:
-            print(err)
+            logger.exception(err)
             return {
                 'result': 'Error: Could not update loan information.'
             }, 500
 
 
 
+# Endpoint to apply many loan payments in one request
+@app.route('/loans/payments', methods=['POST'])
+def loan_payments():
+
+    request_data = request.get_json(silent=True)
+    payments_data = request_data.get('data') if isinstance(request_data, dict) else None
+
+    # Check if data was sent
+    if not payments_data or not isinstance(payments_data, list):
+        return {
+            'result': 'Error: Payment data not received.'
+        }, 400
+
+    if len(payments_data) > max_bulk_size:
+        return {
+            'result': f'Error: At most {max_bulk_size} payments can be applied per request.'
+        }, 400
+
+    results = []
+    payments = []
+
+    for index, payment_data in enumerate(payments_data):
+        try:
+            loan_id = payment_data.get('loan_id')
+            if not isinstance(loan_id, str):
+                raise ValueError('Payment data not valid.')
+
+            loan_id = ObjectId(loan_id)
+            installments, amount = parse_payment(payment_data)
+
+            if not installments:
+                raise ValueError('Payment data not valid.')
+
+            payments.append((len(results), loan_id, installments, amount))
+            results.append({
+                'index': index,
+                'loan_id': str(loan_id),
+            })
+
+        except (InvalidId, TypeError, ValueError, AttributeError):
+            results.append({
+                'index': index,
+                'result': 'Error: Payment data not valid.'
+            })
+
+    try:
+        loans = Loan._get_collection()
+
+        # Read the state of every loan in the batch with one projected query
+        states = loans.find(
+            {'_id': {'$in': list({loan_id for _, loan_id, _, _ in payments})}},
+            {'value': 1, 'installments': 1, 'total_left': 1},
+        )
+        states = {loan['_id']: loan for loan in states}
+
+        # Payments on the same loan apply in order on a running balance and
+        # are written as one update per loan
+        balances = {loan_id: loan.get('total_left') for loan_id, loan in states.items()}
+        updates = {}
+
+        for position, loan_id, installments, amount in payments:
+            loan = states.get(loan_id)
+
+            if loan is None:
+                results[position]['result'] = 'Error: Loan does not exist in the database.'
+                continue
+
+            if not balances[loan_id] or balances[loan_id] <= 0:
+                results[position]['result'] = 'Error: Loan is already fully paid.'
+                continue
+
+            # Priced from the loan, as payment_update does
+            if not amount:
+                if not loan.get('installments'):
+                    results[position]['result'] = 'Error: Payment data not valid.'
+                    continue
+
+                amount = (loan.get('value') or 0) / loan['installments'] * installments
+
+            balances[loan_id] = balances[loan_id] - amount
+
+            update = updates.setdefault(loan_id, {'installments': 0, 'amount': 0, 'positions': []})
+            update['installments'] = update['installments'] + installments
+            update['amount'] = update['amount'] + amount
+            update['positions'].append(position)
+
+        # Each update records the batch id on the loan, so the loans it
+        # applied to can be read back exactly, whatever else wrote to them
+        batch_id = uuid.uuid4().hex
+        operations = []
+
+        for loan_id, update in updates.items():
+            payment = payment_update(update['installments'], update['amount'])
+            payment['$addToSet'] = {'payment_batches': batch_id}
+
+            operations.append(UpdateOne(
+                {'_id': loan_id, 'total_left': {'$gt': 0}, 'payment_batches': {'$ne': batch_id}},
+                payment,
+            ))
+
+        modified = loans.bulk_write(operations, ordered=False).modified_count if operations else 0
+        paid = set(updates)
+        remaining = set()
+
+        # Loans paid off (or deleted) since they were read were not updated
+        if modified < len(operations):
+            paid = {loan['_id'] for loan in loans.find({'_id': {'$in': list(updates)}, 'payment_batches': batch_id}, {'_id': 1})}
+            remaining = {loan['_id'] for loan in loans.find({'_id': {'$in': list(set(updates) - paid)}}, {'_id': 1})}
+
+        for loan_id, update in updates.items():
+            if loan_id in paid:
+                result = 'Payment applied successfully.'
+            elif loan_id in remaining:
+                result = 'Error: Loan is already fully paid.'
+            else:
+                result = 'Error: Loan does not exist in the database.'
+
+            for position in update['positions']:
+                results[position]['result'] = result
+
+        applied = sum(1 for result in results if result['result'] == 'Payment applied successfully.')
+
+        return {
+            'result': 'success',
+            'applied': applied,
+            'failed': len(results) - applied,
+            'results': results
+        }, 200
+
+    except BulkWriteError as err:
+        logger.error('Bulk write failed: %s', err.details)
+        return {
+            'result': 'Error: Could not apply loan payments.'
+        }, 500
+
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'Error: Could not apply loan payments.'
+        }, 500
+
+
 # Endpoint to create a new loan
 @app.route('/loan/', methods=['POST'])
 def new_loan():
 
-    print(request.get_json()) # debug
+    log_payload('request', request.get_json(silent=True))
     if request.get_json():
         loan_data = request.get_json()['data']
     else:
@@ -737,38 +2162,67 @@ def new_loan():
         }, 400
 
     else:
-        employee = loan_data.get('employee')
-        employee = Employee.objects.filter(identification=employee).first()
-        if not employee:
+        try:
+            now = datetime.datetime.now()
+            installments = int(loan_data.get('installments'))
+            value = float(loan_data.get('value'))
+            identification = int(loan_data.get('employee'))
+
+        except (TypeError, ValueError):
             return {
-                'result': 'Error: Employee does not exist.'
+                'result': 'Error: Loan data not valid.'
             }, 400
-        
-        elif employee.current_loans >= 3:
+
+        # Reserve a loan slot atomically: the limit holds under concurrent requests
+        employees = Employee._get_collection()
+        employee = employees.find_one_and_update(
+            {
+                'identification': identification,
+                'current_loans': {'$not': {'$gte': max_loans_per_employee}},
+            },
+            {'$inc': {'current_loans': 1, 'version': 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+        if not employee:
+            if Employee.objects(identification=identification).count():
+                return {
+                    'result': f'Error: Employee cannot have more than {max_loans_per_employee} loans.'
+                }, 400
+
             return {
-                'result': 'Error: Employee cannot have more than 3 loans.'
+                'result': 'Error: Employee does not exist.'
             }, 400
-        else:
-            now = datetime.datetime.now()
-
-            loan_data['employee'] = employee
-            loan_data['installments_paid'] = 0
-            loan_data['start_date'] = now
-            loan_data['total_left'] = loan_data['value']
 
-            installments = int(loan_data.get('installments'))
-            loan_data['end_date'] = now + datetime.timedelta(days=installments * 30)
+        loan_data['employee'] = Employee._from_son(employee)
+        loan_data['value'] = value
+        loan_data['installments'] = installments
+        loan_data['installments_paid'] = 0
+        loan_data['start_date'] = now
+        loan_data['total_left'] = value
+        loan_data['end_date'] = now + datetime.timedelta(days=installments * 30)
 
+        try:
             loan = Loan(**loan_data)
             loan.save()
 
-            employee.current_loans = employee.current_loans + 1
-            employee.save()
+        except Exception as err:
+            logger.exception(err)
+
+            # Release the reserved slot
+            employees.update_one(
+                {'_id': employee['_id']},
+                {'$inc': {'current_loans': -1, 'version': 1}},
+            )
 
             return {
-                'result': 'Loan created successfully.',
-                'loan_data': loan.as_dict()
-            }, 200
+                'result': 'Error: Loan could not be saved in the database.'
+            }, 500
+
+        return {
+            'result': 'Loan created successfully.',
+            'loan_data': loan.as_dict()
+        }, 200
 
 
 
@@ -782,19 +2236,19 @@ def delete_loan(id):
     # Perform deletion as requested
     if loan:
         try:
-            # Update current loans for employee
-            employee = Employee.objects.filter(id=loan.employee.id).first()
-            employee.current_loans = employee.current_loans - 1
-            employee.save()
-
-            loan.delete()
+            # Update current loans for employee, only if this request deleted the loan
+            if Loan.objects(id=loan.id).delete():
+                Employee.objects(id=reference_id(loan, 'employee')).update_one(
+                    dec__current_loans=1,
+                    inc__version=1,
+                )
 
             return {
                 'result': 'Loan deleted successfully.',
             }, 200
         
         except Exception as err:
-            print(err)
+            logger.exception(err)
             return {
                 'result': 'Error: Could not delete Loan information.'
             }, 500
@@ -802,4 +2256,253 @@ def delete_loan(id):
     else:
         return {
             'result': 'Error: Loan ID is not in the database.'
-        }, 400
\ No newline at end of file
+        }, 400
+
+
+# Installment calendar of a loan
+@app.route('/loan/<id>/schedule', methods=['GET'])
+def loan_schedule(id):
+
+    try:
+        loan = Loan.objects(id=id).only('value', 'installments', 'total_paid', 'start_date').as_pymongo().first()
+
+    except ValidationError:
+        return {
+            'result': 'Error: Loan ID not valid.'
+        }, 400
+
+    if not loan:
+        return {
+            'result': 'Error: Loan does not exist in the database.'
+        }, 400
+
+    rows = amortization.schedules(
+        [loan.get('value') or 0],
+        [loan.get('installments') or 0],
+        [loan.get('start_date')],
+        [loan.get('total_paid') or 0],
+    )
+    del rows['loan']
+
+    schedule = amortization.records(rows)
+
+    for installment in schedule:
+        installment['due_date'] = json_date(installment['due_date'])
+
+    return {
+        'result': 'success',
+        'id': str(loan['_id']),
+        'schedule': schedule
+    }, 200
+
+
+# Installments due in a month across every loan: /loans/dues?month=2025-03
+# (the current month by default). Only loans running that month are read,
+# and their schedules are computed together.
+@app.route('/loans/dues', methods=['GET'])
+def loan_dues():
+
+    try:
+        month = request.args.get('month') or datetime.date.today().strftime('%Y-%m')
+        first, last = amortization.month_bounds(month)
+
+    except ValueError:
+        return {
+            'result': 'Error: Month not valid, use YYYY-MM.'
+        }, 400
+
+    try:
+        loans = list(
+            Loan.objects(end_date__gte=first.tolist(), start_date__lt=last.tolist())
+            .only('value', 'installments', 'total_paid', 'start_date')
+            .as_pymongo()
+        )
+
+        rows = amortization.dues(amortization.schedules(
+            [loan.get('value') or 0 for loan in loans],
+            [loan.get('installments') or 0 for loan in loans],
+            [loan.get('start_date') for loan in loans],
+            [loan.get('total_paid') or 0 for loan in loans],
+        ), first, last)
+
+        dues = amortization.records(rows)
+
+        for due in dues:
+            due['loan'] = str(loans[due['loan']]['_id'])
+            due['due_date'] = json_date(due['due_date'])
+
+        return {
+            'result': 'success',
+            'month': str(first.astype('datetime64[M]')),
+            'installments': len(dues),
+            'amount_due': float(rows['amount_due'].sum()),
+            'amount_paid': float(rows['amount_paid'].sum()),
+            'dues': dues
+        }, 200
+
+    except Exception as err:
+        logger.exception(err)
+        return {
+            'result': 'An error has occurred.'
+        }, 500
+
+
+## Management Commands
+
+# Compare declared indexes with the ones in the database, without creating any
+def index_report(model):
+    collection = model._get_db()[model._get_collection_name()]
+    existing = [index['key'] for index in collection.index_information().values()]
+    declared = [index for index in model.list_indexes() if index != [('_id', 1)]]
+
+    return {
+        'missing': [index for index in declared if index not in existing],
+        'extra': [index for index in existing if index not in declared and index != [('_id', 1)]],
+    }
+
+
+# Create declared indexes and report missing ones: flask --app app indexes [--check]
+@app.cli.command('indexes')
+@click.option('--check', is_flag=True, help='Only report missing indexes, do not create them.')
+def manage_indexes(check):
+    missing = 0
+
+    for model in (Company, Employee, Loan):
+        if not check:
+            model.ensure_indexes()
+
+        report = index_report(model)
+        missing = missing + len(report['missing'])
+
+        for index in report['missing']:
+            click.echo(f'{model.__name__}: missing index {index}')
+
+        for index in report['extra']:
+            click.echo(f'{model.__name__}: undeclared index {index}')
+
+    if missing:
+        raise click.ClickException(f'{missing} declared index(es) missing.')
+
+    click.echo('All declared indexes are present.')
+
+
+# Import companies from a CSV file with NIT, name and address columns:
+# flask --app app import-companies companies.csv
+@app.cli.command('import-companies')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_companies_command(path):
+    created = 0
+    failed = 0
+    offset = 0
+
+    chunks = pandas.read_csv(path, dtype=str, keep_default_na=False, chunksize=max_bulk_size)
+
+    for chunk in chunks:
+        results, chunk_created = import_companies(chunk.to_dict('records'))
+        created = created + chunk_created
+        failed = failed + len(results) - chunk_created
+
+        for result in results:
+            if result['result'].startswith('Error'):
+                click.echo(f"Row {offset + result['index'] + 1}: {result['result']}")
+
+        offset = offset + len(chunk)
+
+    click.echo(f'{created} companies created, {failed} failed.')
+
+
+# Generate a synthetic dataset straight into MongoDB, reproducible from --seed:
+# flask --app app generate --companies 10000 --employees 1000000 --loans 0.5
+@app.cli.command('generate')
+@click.option('--companies', 'company_count', default=504, help='Companies to generate.')
+@click.option('--employees', 'employee_count', default=10000, help='Employees to generate.')
+@click.option('--loans', 'loans_per_employee', default=0.5, help='Average loans per employee.')
+@click.option('--seed', default=1, help='Random seed.')
+@click.option('--today', 'now', type=click.DateTime(formats=['%Y-%m-%d']), default='2025-01-01', help='Date loans and salaries are computed at.')
+@click.option('--drop', is_flag=True, help='Drop the existing collections first.')
+def generate_command(company_count, employee_count, loans_per_employee, seed, now, drop):
+    start = time.perf_counter()
+    rng = numpy.random.default_rng(seed)
+
+    if drop:
+        for model in (Company, Employee, Loan):
+            model.drop_collection()
+
+    # Companies
+    companies = generator.company_columns(rng, company_count)
+    company_ids = generator.object_ids(seed, 1, company_count)
+    verification_digits, valid = generate_vds(companies['NIT'])
+
+    if not valid.all():
+        raise click.ClickException('Generated company NITs are not valid.')
+
+    rows = zip(
+        company_ids,
+        generator.values(companies['NIT']),
+        verification_digits.tolist(),
+        generator.values(companies['name']),
+        companies['address'],
+    )
+    documents = (
+        {'_id': _id, 'version': 0, 'NIT': nit, 'verification_digit': verification_digit, 'name': name, 'address': address}
+        for _id, nit, verification_digit, name, address in rows
+    )
+    failed = insert_chunks(Company, documents)
+
+    # Employees, with the number of loans generated for each
+    employees = generator.employee_columns(rng, employee_count, company_count)
+    employee_ids = generator.object_ids(seed, 2, employee_count)
+    loan_counts, loans = generator.loan_columns(rng, employees['hiring_date'], loans_per_employee, max_loans_per_employee, now)
+
+    salaries = calculate_salaries(pandas.Series(employees['hiring_date']).astype('datetime64[ns]'), now)
+
+    rows = zip(
+        employee_ids,
+        generator.values(employees['identification']),
+        generator.values(employees['name']),
+        salaries.tolist(),
+        generator.values(employees['hiring_date']),
+        generator.values(employees['birthdate']),
+        generator.values(employees['company']),
+        loan_counts.tolist(),
+    )
+    documents = (
+        {
+            '_id': _id, 'version': 0, 'identification': identification, 'name': name, 'salary': salary,
+            'hiring_date': hiring_date, 'birthdate': birthdate, 'company': company_ids[company],
+            'current_loans': current_loans,
+        }
+        for _id, identification, name, salary, hiring_date, birthdate, company, current_loans in rows
+    )
+    failed = failed + insert_chunks(Employee, documents)
+
+    # Loans
+    loan_count = len(loans['employee'])
+    rows = zip(
+        generator.object_ids(seed, 3, loan_count),
+        generator.values(loans['value']),
+        generator.values(loans['installments']),
+        generator.values(loans['installments_paid']),
+        generator.values(loans['total_paid']),
+        generator.values(loans['total_left']),
+        generator.values(loans['start_date']),
+        generator.values(loans['end_date']),
+        generator.values(loans['employee']),
+    )
+    documents = (
+        {
+            '_id': _id, 'version': 0, 'value': value, 'installments': installments,
+            'installments_paid': installments_paid, 'total_paid': total_paid, 'total_left': total_left,
+            'start_date': start_date, 'end_date': end_date, 'employee': employee_ids[employee],
+        }
+        for _id, value, installments, installments_paid, total_paid, total_left, start_date, end_date, employee in rows
+    )
+    failed = failed + insert_chunks(Loan, documents)
+
+    for model in (Company, Employee, Loan):
+        model.ensure_indexes()
+
+    click.echo(
+        f'{company_count} companies, {employee_count} employees and {loan_count} loans '
+        f'generated in {time.perf_counter() - start:.1f}s ({failed} failed inserts).'
+    )
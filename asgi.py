@@ -0,0 +1,855 @@
+# System Libraries
+import contextlib
+import datetime
+import logging
+
+# ASGI libraries
+from a2wsgi import WSGIMiddleware
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine.errors import ValidationError
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+# Flask application: models, helpers and the fallback for other endpoints
+from app import (
+    app as flask_app,
+    Company,
+    Employee,
+    Loan,
+    company_cache,
+    calculate_age,
+    calculate_salary,
+    encode_cursor,
+    etag_headers,
+    fields_etag,
+    generate_vd,
+    make_etag,
+    max_loans_per_employee,
+    mongo_client_options,
+    page_arguments,
+    parse_payment,
+    payment_update,
+    raw_company_dict,
+    raw_employee_dict,
+    raw_loan_dict,
+    raw_loan_simple_dict,
+    raw_projection,
+    requested_fields,
+    selected,
+    stream_batch_size,
+    subfields,
+    validate_employee,
+)
+
+logger = logging.getLogger('asgi')
+
+
+##################
+#
+# Async serving mode
+#
+# Run with: uvicorn asgi:application
+# The Company, Employee and Loan endpoints below use the async MongoDB
+# driver with one connection pool per process. Every other route is
+# served by the Flask app in a thread pool.
+#
+##################
+
+# Shared client, created when the server starts
+mongo = {}
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    options = mongo_client_options()
+    options['host'] = options['host'] or 'localhost'
+
+    client = AsyncMongoClient(**options)
+    mongo['client'] = client
+    mongo['database'] = client[flask_app.config['MONGODB_SETTINGS']['db']]
+
+    yield
+
+    await client.close()
+
+
+def collection(model):
+    return mongo['database'][model._get_collection_name()]
+
+
+## Support Functions
+def json_response(body, status=200, headers=None):
+    content = flask_app.json.dumps(body, separators=(',', ':')) + '\n'
+    return Response(content, status_code=status, headers=headers, media_type='application/json')
+
+
+def not_modified(request, etag):
+    return etag in parse_etags(request.headers.get('if-none-match'))
+
+
+async def json_body(request):
+    try:
+        return await request.json()
+
+    except ValueError:
+        return None
+
+
+def wants_stream(request):
+    if request.query_params.get('stream') in ('1', 'true'):
+        return True
+
+    accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+    return accept.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+
+# Fetch the documents with the given ids with a single $in query
+async def fetch_by_ids(model, ids, projection=None):
+    ids = list({document_id for document_id in ids if document_id is not None})
+
+    if not ids:
+        return {}
+
+    return {document['_id']: document async for document in collection(model).find({'_id': {'$in': ids}}, projection)}
+
+
+# List serializers: a constant number of queries regardless of page size.
+# References are only fetched when the ?fields= selection includes them.
+async def serialize_companies(companies, fields=None):
+    return [raw_company_dict(company, fields) for company in companies]
+
+
+async def serialize_employees(employees, fields=None):
+    companies = {}
+
+    if selected(fields, 'company'):
+        companies = await fetch_by_ids(Company, [employee.get('company') for employee in employees])
+
+    return [raw_employee_dict(employee, companies, fields) for employee in employees]
+
+
+async def serialize_loans(loans, fields=None):
+    employees = {}
+    companies = {}
+    employee_fields = subfields(fields, 'employee')
+
+    if selected(fields, 'employee'):
+        employees = await fetch_by_ids(Employee, [loan.get('employee') for loan in loans], raw_projection(Employee, employee_fields))
+
+    if selected(employee_fields, 'company'):
+        companies = await fetch_by_ids(Company, [employee.get('company') for employee in employees.values()])
+
+    return [raw_loan_dict(loan, employees, companies, fields) for loan in loans]
+
+
+async def stream_documents(cursor, serializer):
+    batch = []
+
+    async for document in cursor:
+        batch.append(document)
+
+        if len(batch) == stream_batch_size:
+            for record in await serializer(batch):
+                yield flask_app.json.dumps(record) + '\n'
+
+            batch = []
+
+    for record in await serializer(batch):
+        yield flask_app.json.dumps(record) + '\n'
+
+
+# Shared implementation of the paginated / streamed list endpoints
+async def list_documents(request, model, key, serializer, error_message):
+    try:
+        limit, after = page_arguments(request.query_params)
+        fields = requested_fields(model, request.query_params)
+
+    except ValueError as err:
+        return json_response({
+            'result': f'Error: {err}'
+        }, 400)
+
+    query = {'_id': {'$gt': after}} if after else {}
+    cursor = collection(model).find(query, raw_projection(model, fields)).sort('_id', 1)
+
+    if wants_stream(request):
+        cursor = cursor.batch_size(stream_batch_size)
+        return StreamingResponse(
+            stream_documents(cursor, lambda batch: serializer(batch, fields)),
+            media_type='application/x-ndjson',
+        )
+
+    try:
+        page = await cursor.limit(limit + 1).to_list()
+
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1]['_id'])
+        else:
+            next_cursor = None
+
+        return json_response({
+            'result': 'success',
+            key: await serializer(page, fields),
+            'next_cursor': next_cursor
+        })
+
+    except Exception:
+        return json_response({
+            'result': error_message
+        }, 500)
+
+
+# Update for the fields changed on a document, bumping its version like save()
+def changes_update(document):
+    changes = document._delta()[0]
+    update = {'$inc': {'version': 1}}
+
+    if changes:
+        update['$set'] = changes
+
+    return update
+
+
+def invalidate_company(company):
+    company_cache.pop(('NIT', company.get('NIT')))
+    company_cache.pop(('id', company['_id']))
+
+
+## API Endpoints
+
+#####
+#
+# Company Endpoints
+#
+#####
+
+async def list_companies(request):
+    return await list_documents(request, Company, 'companies', serialize_companies, 'An error has occured.')
+
+
+async def company(request):
+    nit = str(request.path_params['nit'])
+    companies = collection(Company)
+
+    # Read
+    if request.method == 'GET':
+        try:
+            fields = requested_fields(Company, request.query_params)
+
+        except ValueError as err:
+            return json_response({
+                'result': f'Error: {err}'
+            }, 400)
+
+        result = await companies.find_one({'NIT': nit})
+
+        if result:
+            etag = fields_etag(make_etag((result['_id'], result.get('version'))), fields)
+
+            if not_modified(request, etag):
+                return Response(status_code=304, headers=etag_headers(etag))
+
+            return json_response({
+                'result': 'success',
+                'company': raw_company_dict(result, fields)
+            }, 200, etag_headers(etag))
+
+        return json_response({
+            'result': 'Error: Company ID is not in the database.'
+        }, 400)
+
+    # Update
+    result = await companies.find_one({'NIT': nit})
+
+    if not result:
+        return json_response({
+            'result': 'Error: Company ID is not in the database.'
+        }, 400)
+
+    company_data = await json_body(request) or {}
+
+    try:
+        company = Company._from_son(result)
+
+        for field in ('NIT', 'name', 'address'):
+            if company_data.get(field):
+                setattr(company, field, company_data.get(field))
+
+        company.validate()
+
+        updated = await companies.find_one_and_update(
+            {'_id': result['_id']},
+            changes_update(company),
+            return_document=ReturnDocument.AFTER,
+        )
+
+        invalidate_company(result)
+        invalidate_company(updated)
+
+        return json_response({
+            'result': 'Company information updated successfully.',
+            'company_data': raw_company_dict(updated)
+        })
+
+    except ValidationError:
+        return json_response({
+            'result': 'Error: Employee data not valid.'
+        }, 500)
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Could not update company information.'
+        }, 500)
+
+
+async def new_company(request):
+    company_data = await json_body(request)
+
+    # Check if data was sent
+    if not company_data:
+        return json_response({
+            'result': 'Error: Company data not received.'
+        }, 400)
+
+    try:
+        # Calculate validation digit
+        company_data['verification_digit'] = generate_vd(company_data.get('NIT', False))
+
+        company = Company(**company_data)
+        company.version = 1
+        company.validate()
+
+        await collection(Company).insert_one(company.to_mongo().to_dict())
+
+        return json_response({
+            'result': 'success',
+            'company_data': company.as_dict()
+        })
+
+    except DuplicateKeyError:
+        return json_response({
+            'result': 'Error: A company with the provided NIT already exists.'
+        }, 400)
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Company could not be saved in the database.'
+        }, 500)
+
+
+async def delete_company(request):
+    try:
+        result = await collection(Company).find_one_and_delete({'NIT': str(request.path_params['nit'])})
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Could not delete company information.'
+        }, 500)
+
+    if not result:
+        return json_response({
+            'result': 'Error: Company ID is not in the database.'
+        }, 400)
+
+    invalidate_company(result)
+
+    return json_response({
+        'result': 'Company deleted successfully.',
+    })
+
+
+#####
+#
+# Employee Endpoints
+#
+#####
+
+async def list_employees(request):
+    return await list_documents(request, Employee, 'employees', serialize_employees, 'An error has occurred.')
+
+
+async def employee(request):
+    identification = request.path_params['id']
+    employees = collection(Employee)
+
+    # Read
+    if request.method == 'GET':
+        try:
+            fields = requested_fields(Employee, request.query_params)
+
+        except ValueError as err:
+            return json_response({
+                'result': f'Error: {err}'
+            }, 400)
+
+        result = await employees.find_one({'identification': identification})
+
+        if not result:
+            return json_response({
+                'result': 'Error: Employee ID is not in the database.'
+            }, 400)
+
+        companies = await fetch_by_ids(Company, [result.get('company')])
+        company = companies.get(result.get('company'))
+
+        etag = fields_etag(make_etag(
+            (result['_id'], result.get('version')),
+            (company['_id'], company.get('version')) if company else (None, None),
+        ), fields)
+
+        if not_modified(request, etag):
+            return Response(status_code=304, headers=etag_headers(etag))
+
+        return json_response(raw_employee_dict(result, companies, fields), 200, etag_headers(etag))
+
+    # Update
+    result = await employees.find_one({'identification': identification})
+
+    if not result:
+        return json_response({
+            'result': 'Error: Employee ID is not in the database.'
+        }, 400)
+
+    employee_data = (await json_body(request) or {}).get('data', False)
+
+    try:
+        # Validate data
+        validate_employee(employee_data)
+
+        employee = Employee._from_son(result)
+
+        for field in ('identification', 'name', 'hiring_date', 'birthdate'):
+            if employee_data.get(field, False):
+                setattr(employee, field, employee_data.get(field))
+
+        employee.salary = calculate_salary(employee_data.get('hiring_date'))
+        employee.validate()
+
+        updated = await employees.find_one_and_update(
+            {'_id': result['_id']},
+            changes_update(employee),
+            return_document=ReturnDocument.AFTER,
+        )
+        companies = await fetch_by_ids(Company, [updated.get('company')])
+
+        return json_response({
+            'result': 'Employee information updated successfully.',
+            'employee_data': raw_employee_dict(updated, companies)
+        })
+
+    except ValidationError:
+        return json_response({
+            'result': 'Error: Employee data not valid.'
+        }, 500)
+
+    except DuplicateKeyError:
+        return json_response({
+            'result': 'Employee ID already exists in the database.'
+        })
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Could not update employee information.'
+        }, 500)
+
+
+async def new_employee(request):
+    request_data = await json_body(request)
+
+    if not request_data:
+        return json_response({
+            'result': 'Error: Employee data not received.'
+        }, 400)
+
+    employee_data = request_data.get('data')
+
+    # Check if data was sent
+    if not employee_data:
+        return json_response({
+            'result': 'Error: Employee data not received.'
+        }, 400)
+
+    try:
+        validate_employee(employee_data)
+
+        company = await collection(Company).find_one({'NIT': employee_data.get('company')})
+        employee_data['company'] = company['_id'] if company else None
+
+        # Calculate salary
+        employee_data['salary'] = calculate_salary(employee_data.get('hiring_date'))
+
+        # Default value for current_loans
+        employee_data['current_loans'] = 0
+
+        # Validate age
+        age = calculate_age(employee_data.get('birthdate'))
+
+        if age > 70:
+            return json_response({
+                'result': 'Error: Employee exceeds maximum allowed age.'
+            }, 400)
+        elif age < 18:
+            return json_response({
+                'result': 'Error: Employee is below minimum allowed age.'
+            }, 400)
+
+        employee = Employee(**employee_data)
+        employee.version = 1
+        employee.validate()
+
+        document = employee.to_mongo().to_dict()
+        await collection(Employee).insert_one(document)
+
+        return json_response({
+            'result': 'Employee created successfully.',
+            'employee_data': raw_employee_dict(document, {company['_id']: company} if company else {})
+        })
+
+    except DuplicateKeyError:
+        return json_response({
+            'result': 'Error: An employee with the provided ID already exists.'
+        }, 400)
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Employee could not be saved in the database.'
+        }, 500)
+
+
+async def delete_employee(request):
+    try:
+        result = await collection(Employee).find_one_and_delete({'identification': request.path_params['identification']})
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Could not delete employee information.'
+        }, 500)
+
+    if not result:
+        return json_response({
+            'result': 'Error: Employee ID is not in the database.'
+        }, 400)
+
+    return json_response({
+        'result': 'Employee deleted successfully.',
+    })
+
+
+async def employee_company(request):
+    employee = await collection(Employee).find_one(
+        {'identification': request.path_params['identification']},
+        {'company': 1},
+    )
+
+    if not employee:
+        return json_response({
+            'result': 'Error: Employee ID is not in the database.'
+        }, 400)
+
+    company = None
+    if employee.get('company'):
+        company = await collection(Company).find_one({'_id': employee['company']})
+
+    if not company:
+        return json_response({
+            'result': 'Error: Employee not registered to any company.'
+        }, 400)
+
+    return json_response({
+        'company': raw_company_dict(company),
+    })
+
+
+async def employee_age(request):
+    employee = await collection(Employee).find_one(
+        {'identification': request.path_params['identification']},
+        {'birthdate': 1},
+    )
+
+    if not employee:
+        return json_response({
+            'result': 'Error: Employee ID is not in the database.'
+        }, 400)
+
+    return json_response({
+        'age': int(calculate_age(employee.get('birthdate')))
+    })
+
+
+async def employee_loans(request):
+    employee = await collection(Employee).find_one(
+        {'identification': request.path_params['identification']},
+        {'_id': 1},
+    )
+
+    if not employee:
+        return json_response({
+            'result': 'Error: Employee ID is not in the database.'
+        }, 400)
+
+    loans = collection(Loan).find({'employee': employee['_id']})
+
+    return json_response({
+        'result': [raw_loan_simple_dict(loan) async for loan in loans]
+    })
+
+
+#####
+#
+# Loan Endpoints
+#
+#####
+
+async def list_loans(request):
+    return await list_documents(request, Loan, 'loans', serialize_loans, 'An error has occurred.')
+
+
+# Loan with its employee and company, for responses
+async def loan_response(loan, fields=None):
+    employees = await fetch_by_ids(Employee, [loan.get('employee')])
+    companies = await fetch_by_ids(Company, [employee.get('company') for employee in employees.values()])
+
+    return raw_loan_dict(loan, employees, companies, fields), employees, companies
+
+
+async def loan_data(request):
+    loans = collection(Loan)
+
+    try:
+        loan_id = ObjectId(request.path_params['id'])
+
+    except InvalidId:
+        return json_response({
+            'result': 'Error: Loan ID not valid.'
+        }, 400)
+
+    # Read
+    if request.method == 'GET':
+        try:
+            fields = requested_fields(Loan, request.query_params)
+
+        except ValueError as err:
+            return json_response({
+                'result': f'Error: {err}'
+            }, 400)
+
+        result = await loans.find_one({'_id': loan_id})
+        loan_dict, employees, companies = await loan_response(result, fields) if result else (None, {}, {})
+
+        if not result:
+            return json_response({
+                'result': 'Error: Loan does not exist in the database.'
+            }, 400)
+
+        # Loans of deleted employees keep an empty employee part
+        employee = employees.get(result.get('employee'))
+        company = companies.get(employee.get('company')) if employee else None
+        etag = fields_etag(make_etag(
+            (result['_id'], result.get('version')),
+            (employee['_id'], employee.get('version')) if employee else (None, None),
+            (company['_id'], company.get('version')) if company else (None, None),
+        ), fields)
+
+        if not_modified(request, etag):
+            return Response(status_code=304, headers=etag_headers(etag))
+
+        return json_response(loan_dict, 200, etag_headers(etag))
+
+    # Update
+    try:
+        installments, amount = parse_payment((await json_body(request) or {}).get('data') or {})
+
+    except (TypeError, ValueError, AttributeError):
+        return json_response({
+            'result': 'Error: Payment data not valid.'
+        }, 400)
+
+    try:
+        # Apply the payment and read the new state in the same operation
+        if installments:
+            loan = await loans.find_one_and_update(
+                {'_id': loan_id, 'total_left': {'$gt': 0}},
+                payment_update(installments, amount),
+                return_document=ReturnDocument.AFTER,
+            )
+        else:
+            loan = await loans.find_one({'_id': loan_id})
+
+        if loan:
+            return json_response({
+                'result': 'Loan updated successfully.',
+                'loan_data': (await loan_response(loan))[0]
+            })
+
+        elif await loans.count_documents({'_id': loan_id}, limit=1):
+            return json_response({
+                'result': 'Error: Loan is already fully paid.'
+            }, 400)
+
+        return json_response({
+            'result': 'Error: Loan does not exist in the database.'
+        }, 400)
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Could not update loan information.'
+        }, 500)
+
+
+async def new_loan(request):
+    request_data = await json_body(request)
+
+    if not request_data:
+        return json_response({
+            'result': 'Error: Employee data not received.'
+        }, 400)
+
+    loan_data = request_data.get('data')
+
+    # Check if data was sent
+    if not loan_data:
+        return json_response({
+            'result': 'Error: Employee data not received.'
+        }, 400)
+
+    try:
+        now = datetime.datetime.now()
+        installments = int(loan_data.get('installments'))
+        value = float(loan_data.get('value'))
+        identification = int(loan_data.get('employee'))
+
+    except (TypeError, ValueError):
+        return json_response({
+            'result': 'Error: Loan data not valid.'
+        }, 400)
+
+    # Reserve a loan slot atomically: the limit holds under concurrent requests
+    employees = collection(Employee)
+    employee = await employees.find_one_and_update(
+        {
+            'identification': identification,
+            'current_loans': {'$not': {'$gte': max_loans_per_employee}},
+        },
+        {'$inc': {'current_loans': 1, 'version': 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+    if not employee:
+        if await employees.count_documents({'identification': identification}, limit=1):
+            return json_response({
+                'result': f'Error: Employee cannot have more than {max_loans_per_employee} loans.'
+            }, 400)
+
+        return json_response({
+            'result': 'Error: Employee does not exist.'
+        }, 400)
+
+    loan_data['employee'] = employee['_id']
+    loan_data['value'] = value
+    loan_data['installments'] = installments
+    loan_data['installments_paid'] = 0
+    loan_data['start_date'] = now
+    loan_data['total_left'] = value
+    loan_data['end_date'] = now + datetime.timedelta(days=installments * 30)
+
+    try:
+        loan = Loan(**loan_data)
+        loan.version = 1
+        loan.validate()
+
+        document = loan.to_mongo().to_dict()
+        await collection(Loan).insert_one(document)
+
+    except Exception as err:
+        logger.exception(err)
+
+        # Release the reserved slot
+        await employees.update_one(
+            {'_id': employee['_id']},
+            {'$inc': {'current_loans': -1, 'version': 1}},
+        )
+
+        return json_response({
+            'result': 'Error: Loan could not be saved in the database.'
+        }, 500)
+
+    companies = await fetch_by_ids(Company, [employee.get('company')])
+
+    return json_response({
+        'result': 'Loan created successfully.',
+        'loan_data': raw_loan_dict(document, {employee['_id']: employee}, companies)
+    })
+
+
+async def delete_loan(request):
+    try:
+        loan = await collection(Loan).find_one_and_delete({'_id': ObjectId(request.path_params['id'])})
+
+    except InvalidId:
+        loan = None
+
+    except Exception as err:
+        logger.exception(err)
+        return json_response({
+            'result': 'Error: Could not delete Loan information.'
+        }, 500)
+
+    if not loan:
+        return json_response({
+            'result': 'Error: Loan ID is not in the database.'
+        }, 400)
+
+    # Update current loans for employee
+    await collection(Employee).update_one(
+        {'_id': loan.get('employee')},
+        {'$inc': {'current_loans': -1, 'version': 1}},
+    )
+
+    return json_response({
+        'result': 'Loan deleted successfully.',
+    })
+
+
+routes = [
+    Route('/companies/', list_companies, methods=['GET']),
+    Route('/company/{nit}', company, methods=['GET', 'POST']),
+    Route('/company/{nit}/', company, methods=['GET', 'POST']),
+    Route('/company/', new_company, methods=['POST']),
+    Route('/company/{nit:int}/delete', delete_company, methods=['POST']),
+    Route('/employees/', list_employees, methods=['GET']),
+    Route('/employee/{id:int}', employee, methods=['GET', 'POST']),
+    Route('/employee/', new_employee, methods=['POST']),
+    Route('/employee/{identification:int}/delete', delete_employee, methods=['POST']),
+    Route('/employee/{identification:int}/company', employee_company, methods=['GET']),
+    Route('/employee/{identification:int}/age', employee_age, methods=['GET']),
+    Route('/employee/{identification:int}/loans', employee_loans, methods=['GET']),
+    Route('/loans/', list_loans, methods=['GET']),
+    Route('/loan/{id}', loan_data, methods=['GET', 'POST']),
+    Route('/loan/', new_loan, methods=['POST']),
+    Route('/loan/{id}/delete', delete_loan, methods=['POST']),
+
+    # Everything else is served by the Flask app
+    Mount('/', app=WSGIMiddleware(flask_app)),
+]
+
+application = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+)
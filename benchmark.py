@@ -0,0 +1,528 @@
+import argparse
+import datetime
+import itertools
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+import requests
+
+import generator
+from inputs import names, companies
+
+# Load test for every route in endpoints.txt.
+#
+#   python benchmark.py --scale 100000 --clients 32 --duration 60 --output results.json
+#
+# Seeds the database behind --url through the bulk endpoints (companies from
+# inputs.companies, --scale employees, loans for a tenth of them), then runs
+# --clients concurrent workers over a weighted read/write mix and reports
+# throughput and p50/p95/p99 latency per route as JSON.
+
+bulk_size = 10000
+first_identification = 1000000000
+
+
+##################
+#
+# Seeding
+#
+##################
+
+def seed_employees(session, url, scale, seed):
+    rng = numpy.random.default_rng(seed)
+    created = 0
+
+    for offset in range(0, scale, bulk_size):
+        size = min(bulk_size, scale - offset)
+
+        birthdates = numpy.datetime_as_string(generator.random_dates(rng, size, '1980-01-01', '1995-12-31')).tolist()
+        hiring_dates = numpy.datetime_as_string(generator.random_dates(rng, size, '2005-01-01', '2022-12-31')).tolist()
+        employee_names = rng.choice(names, size=size)
+
+        employees = [
+            {
+                'identification': first_identification + offset + index,
+                'name': employee_names[index],
+                'hiring_date': hiring_dates[index].replace('-', '/'),
+                'birthdate': birthdates[index].replace('-', '/'),
+                'company': companies[(offset + index) % len(companies)],
+            }
+            for index in range(size)
+        ]
+
+        response = session.post(f'{url}/employees/bulk', json={'data': employees})
+        created = created + response.json().get('created', 0)
+
+    return created
+
+
+def seed_database(url, scale, clients, seed):
+    session = requests.Session()
+
+    # Already seeded at this scale
+    if session.get(f'{url}/employee/{first_identification + scale - 1}').status_code == 200:
+        return False
+
+    session.post(f'{url}/companies/bulk', json={'data': [
+        {'NIT': nit, 'name': f'Company {nit}', 'address': f'Address {index}'}
+        for index, nit in enumerate(companies)
+    ]})
+
+    seed_employees(session, url, scale, seed)
+
+    # Loans for a tenth of the employees
+    def new_loan(identification):
+        requests.post(f'{url}/loan/', json={'data': {
+            'employee': identification,
+            'installments': 12,
+            'value': 1200000,
+        }})
+
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(new_loan, range(first_identification, first_identification + max(scale // 10, 1))))
+
+    return True
+
+
+##################
+#
+# Workload
+#
+##################
+
+# Ids the workload reads from and writes to. Documents created during the
+# run come from a range of their own so delete operations only remove them.
+class Dataset:
+
+    def __init__(self, url, scale):
+        self.nits = list(companies)
+        self.identifications = range(first_identification, first_identification + scale)
+
+        response = requests.get(f'{url}/loans/', params={'limit': 1000})
+        self.loan_ids = [loan['id'] for loan in response.json().get('loans', [])]
+
+        # New ids for this run, away from the seeded ranges
+        run = int(time.time()) % 100000
+        self.new_nits = itertools.count(600000000 + run * 1000)
+        self.new_identifications = itertools.count(2000000000 + run * 100000)
+
+        self.created_nits = []
+        self.created_identifications = []
+        self.created_loan_ids = []
+
+
+def new_company(nit):
+    return {'NIT': str(nit), 'name': f'Company {nit}', 'address': 'Benchmark'}
+
+
+def new_employee(rng, identification, nit):
+    return {
+        'identification': identification,
+        'name': rng.choice(names),
+        'hiring_date': f'{rng.randint(2005, 2022)}/{rng.randint(1, 12):02}/{rng.randint(1, 28):02}',
+        'birthdate': f'{rng.randint(1980, 1995)}/{rng.randint(1, 12):02}/{rng.randint(1, 28):02}',
+        'company': nit,
+    }
+
+
+def pop(items):
+    try:
+        return items.pop()
+    except IndexError:
+        return None
+
+
+# Each operation returns (route, method, path, json body) or None when
+# there is nothing for it to work on yet
+def operations(data):
+
+    def company_create(rng):
+        nit = next(data.new_nits)
+        data.created_nits.append(nit)
+        return 'POST /company/', 'POST', '/company/', new_company(nit)
+
+    def company_delete(rng):
+        nit = pop(data.created_nits)
+        return nit and ('POST /company/<int:nit>/delete', 'POST', f'/company/{nit}/delete', None)
+
+    def companies_bulk(rng):
+        nits = [next(data.new_nits) for index in range(10)]
+        data.created_nits.extend(nits)
+        return 'POST /companies/bulk', 'POST', '/companies/bulk', {'data': [new_company(nit) for nit in nits]}
+
+    def employee_create(rng):
+        identification = next(data.new_identifications)
+        data.created_identifications.append(identification)
+        return 'POST /employee/', 'POST', '/employee/', {'data': new_employee(rng, identification, rng.choice(data.nits))}
+
+    def employee_update(rng):
+        identification = rng.choice(data.identifications)
+        return 'POST /employee/<int:id>', 'POST', f'/employee/{identification}', {
+            'data': new_employee(rng, identification, rng.choice(data.nits)),
+        }
+
+    def employees_bulk(rng):
+        identifications = [next(data.new_identifications) for index in range(10)]
+        data.created_identifications.extend(identifications)
+        return 'POST /employees/bulk', 'POST', '/employees/bulk', {
+            'data': [new_employee(rng, identification, rng.choice(data.nits)) for identification in identifications],
+        }
+
+    def employee_delete(rng):
+        identification = pop(data.created_identifications)
+        return identification and (
+            'POST /employee/<int:identification>/delete', 'POST', f'/employee/{identification}/delete', None,
+        )
+
+    def loan_create(rng):
+        return 'POST /loan/', 'POST', '/loan/', {'data': {
+            'employee': rng.choice(data.identifications),
+            'installments': rng.choice([6, 12, 24]),
+            'value': rng.randint(1, 20) * 100000,
+        }}
+
+    def loan_payment(rng):
+        return data.loan_ids and (
+            'POST /loan/<id>', 'POST', f'/loan/{rng.choice(data.loan_ids)}', {'data': {'installments': 1}},
+        )
+
+    def loans_payments(rng):
+        return data.loan_ids and ('POST /loans/payments', 'POST', '/loans/payments', {'data': [
+            {'loan_id': rng.choice(data.loan_ids), 'installments': 1} for index in range(10)
+        ]})
+
+    def loan_delete(rng):
+        loan_id = pop(data.created_loan_ids)
+        return loan_id and ('POST /loan/<id>/delete', 'POST', f'/loan/{loan_id}/delete', None)
+
+    def get(route, path=None):
+        return lambda rng: (f'GET {route}', 'GET', path(rng) if path else route, None)
+
+    months = [f'{year}-{month:02d}' for year in (2025, 2026) for month in range(1, 13)]
+    nit = lambda rng: rng.choice(data.nits)
+    identification = lambda rng: rng.choice(data.identifications)
+
+    # (operation, weight): mostly single document reads, some list pages,
+    # a few writes and the occasional company wide report
+    return [
+        (get('/healthz'), 1),
+        (get('/metrics'), 1),
+        (get('/admin/slow-queries'), 1),
+        (lambda rng: ('POST /admin/slow-queries/clear', 'POST', '/admin/slow-queries/clear', None), 0.1),
+        (get('/companies/', lambda rng: '/companies/?limit=100'), 3),
+        (get('/company/<nit>', lambda rng: f'/company/{nit(rng)}'), 20),
+        (get('/company/<nit>/', lambda rng: f'/company/{nit(rng)}/'), 1),
+        (lambda rng: ('POST /company/<nit>', 'POST', f'/company/{nit(rng)}', {'address': f'Address {rng.randint(1, 1000)}'}), 1),
+        (lambda rng: ('POST /company/<nit>/', 'POST', f'/company/{nit(rng)}/', {'address': f'Address {rng.randint(1, 1000)}'}), 0.2),
+        (company_create, 1),
+        (companies_bulk, 0.2),
+        (get('/company/<nit>/payroll', lambda rng: f'/company/{nit(rng)}/payroll'), 2),
+        (get('/companies/payroll', lambda rng: '/companies/payroll?limit=10'), 0.2),
+        (get('/company/<nit>/stats', lambda rng: f'/company/{nit(rng)}/stats'), 2),
+        (get('/companies/stats'), 0.2),
+        (get('/companies/cache'), 1),
+        (company_delete, 1),
+        (get('/employees/', lambda rng: '/employees/?limit=100'), 3),
+        (get('/employee/<int:id>', lambda rng: f'/employee/{identification(rng)}'), 20),
+        (employee_update, 2),
+        (employee_create, 2),
+        (employees_bulk, 0.5),
+        (employee_delete, 2),
+        (get('/employee/<int:identification>/company', lambda rng: f'/employee/{identification(rng)}/company'), 5),
+        (get('/employee/<int:identification>/age', lambda rng: f'/employee/{identification(rng)}/age'), 5),
+        (get('/employee/<int:identification>/loans', lambda rng: f'/employee/{identification(rng)}/loans'), 5),
+        (get('/loans/', lambda rng: '/loans/?limit=100'), 3),
+        (lambda rng: data.loan_ids and ('GET /loan/<id>', 'GET', f'/loan/{rng.choice(data.loan_ids)}', None), 10),
+        (lambda rng: data.loan_ids and ('GET /loan/<id>/schedule', 'GET', f'/loan/{rng.choice(data.loan_ids)}/schedule', None), 2),
+        (get('/loans/dues', lambda rng: f'/loans/dues?month={rng.choice(months)}'), 0.2),
+        (loan_payment, 2),
+        (loans_payments, 0.5),
+        (loan_create, 2),
+        (loan_delete, 2),
+    ]
+
+
+def worker(url, data, seed, deadline):
+    rng = random.Random(seed)
+    session = requests.Session()
+
+    ops = operations(data)
+    choices = [operation for operation, weight in ops]
+    weights = [weight for operation, weight in ops]
+
+    latencies = {}
+    errors = {}
+
+    while time.monotonic() < deadline:
+        request = rng.choices(choices, weights)[0](rng)
+        if not request:
+            continue
+
+        route, method, path, body = request
+
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url + path, json=body)
+            failed = response.status_code >= 500
+        except requests.RequestException:
+            response = None
+            failed = True
+        elapsed = time.perf_counter() - start
+
+        latencies.setdefault(route, []).append(elapsed)
+        errors[route] = errors.get(route, 0) + failed
+
+        # Keep loans created during the run for the delete operation
+        if route == 'POST /loan/' and response is not None and response.status_code == 200:
+            data.created_loan_ids.append(response.json()['loan_data']['id'])
+
+    return latencies, errors
+
+
+##################
+#
+# Report
+#
+##################
+
+# Routes listed in endpoints.txt as 'METHOD rule'
+def documented_routes(path='endpoints.txt'):
+    routes = set()
+
+    with open(path) as file:
+        for rule, methods in re.findall(r"@app\.route\('([^']+)', methods=\[([^\]]+)\]\)", file.read()):
+            for method in re.findall(r"'(\w+)'", methods):
+                routes.add(f'{method} {rule}')
+
+    return routes
+
+
+def summary(latencies, errors, duration):
+    latencies = numpy.asarray(latencies) * 1000
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / duration,
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(latencies.max()),
+    }
+
+
+def run(url, scale, clients, duration, seed):
+    data = Dataset(url, scale)
+    deadline = time.monotonic() + duration
+
+    with ThreadPoolExecutor(clients) as executor:
+        results = list(executor.map(lambda client: worker(url, data, seed + client, deadline), range(clients)))
+
+    latencies = {}
+    errors = {}
+
+    for worker_latencies, worker_errors in results:
+        for route, values in worker_latencies.items():
+            latencies.setdefault(route, []).extend(values)
+            errors[route] = errors.get(route, 0) + worker_errors[route]
+
+    return {
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'url': url,
+        'scale': scale,
+        'clients': clients,
+        'duration_s': duration,
+        'seed': seed,
+        'total': summary(list(itertools.chain(*latencies.values())), sum(errors.values()), duration),
+        'endpoints': {route: summary(latencies[route], errors[route], duration) for route in sorted(latencies)},
+        'not_covered': sorted(documented_routes() - set(latencies)),
+    }
+
+
+##################
+#
+# JSON encoding
+#
+##################
+
+# The Document path the list endpoints had before raw reads: each employee
+# serialized once per page, companies from the cache
+def document_loans_as_dicts(loans, employees):
+    import app
+
+    employee_dicts = {employee_id: employee.as_dict() for employee_id, employee in employees.items()}
+    records = [loan.simple_dict() for loan in loans]
+
+    for record, loan in zip(records, loans):
+        record['employee'] = employee_dicts.get(app.reference_id(loan, 'employee'))
+
+    return records
+
+
+def document_loans_page(loans):
+    import app
+
+    employee_ids = list({app.reference_id(loan, 'employee') for loan in loans})
+    return document_loans_as_dicts(loans, {employee.id: employee for employee in app.Employee.objects(id__in=employee_ids)})
+
+
+# Time document_loans_as_dicts and the JSON encoding of a list_loans payload
+# of count in memory loans, with Flask's default provider (on the dates and
+# nested documents it used to receive) and with the configured one
+def encoding_benchmark(count, repeat=5):
+    from flask.json.provider import DefaultJSONProvider
+    from bson import ObjectId
+
+    import app
+
+    rng = numpy.random.default_rng(1)
+    dates = generator.values(generator.random_dates(rng, count, '2005-01-01', '2022-12-31'))
+
+    company_documents = [
+        app.Company(id=ObjectId(), NIT=nit, name=f'Company {nit}', address='Address')
+        for nit in companies[:100]
+    ]
+    employees = [
+        app.Employee(
+            id=ObjectId(), identification=first_identification + index, name=names[index % len(names)],
+            salary=1300000.0, hiring_date=dates[index].date(), birthdate=dates[-index].date(),
+            company=company_documents[index % len(company_documents)], current_loans=3,
+        )
+        for index in range(count // 3 + 1)
+    ]
+    loans = [
+        app.Loan(
+            id=ObjectId(), value=1200000.0, installments=12, installments_paid=3, total_paid=300000.0,
+            total_left=900000.0, start_date=dates[index].date(), end_date=dates[index].date(),
+            employee=employees[index // 3],
+        )
+        for index in range(count)
+    ]
+    employee_map = {employee.id: employee for employee in employees}
+
+    for company in company_documents:
+        app.cache_company(company)
+
+    def best(function):
+        timings = []
+        for attempt in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - start)
+
+        return min(timings) * 1000, result
+
+    serialize_ms, payload = best(lambda: document_loans_as_dicts(loans, employee_map))
+    body = {'result': 'success', 'loans': payload, 'next_cursor': None}
+
+    # Before: every loan carried date objects for the encoder to convert
+    def with_dates(record, loan):
+        employee = loan.employee
+        record = dict(record, start_date=loan.start_date, end_date=loan.end_date)
+        record['employee'] = dict(record['employee'], hiring_date=employee.hiring_date, birthdate=employee.birthdate)
+        return record
+
+    before = {'result': 'success', 'loans': [with_dates(record, loan) for record, loan in zip(payload, loans)], 'next_cursor': None}
+
+    with app.app.app_context():
+        default_ms, default_response = best(lambda: DefaultJSONProvider(app.app).response(before))
+        encode_ms, response = best(lambda: app.app.json.response(body))
+
+    return {
+        'loans': count,
+        'provider': type(app.app.json).__name__,
+        'serialize_ms': serialize_ms,
+        'default_encode_ms': default_ms,
+        'encode_ms': encode_ms,
+        'bytes': len(response.get_data()),
+    }
+
+
+##################
+#
+# Read path
+#
+##################
+
+# CPU time of the list endpoints' read path on the first count documents of
+# each collection in the configured database (see flask generate): Documents
+# and their as_dict methods against as_pymongo() records and the raw_*
+# serializers the endpoints use
+def read_benchmark(count, repeat=5):
+    import app
+
+    paths = [
+        ('companies', app.Company, lambda companies: [company.as_dict() for company in companies], app.raw_companies_as_dicts),
+        ('employees', app.Employee, lambda employees: [employee.as_dict() for employee in employees], app.raw_employees_as_dicts),
+        ('loans', app.Loan, document_loans_page, app.raw_loans_as_dicts),
+    ]
+
+    def best(function):
+        timings = []
+        for attempt in range(repeat):
+            start = time.process_time()
+            result = function()
+            timings.append(time.process_time() - start)
+
+        return min(timings) * 1000, result
+
+    report = {}
+
+    with app.app.app_context():
+        for name, model, serializer, raw_serializer in paths:
+            queryset = model.objects.order_by('id').limit(count)
+
+            documents_ms, payload = best(lambda: serializer(list(queryset.clone())))
+            raw_ms, raw_payload = best(lambda: raw_serializer(list(queryset.clone().as_pymongo())))
+
+            report[name] = {
+                'records': len(payload),
+                'documents_ms': documents_ms,
+                'raw_ms': raw_ms,
+                'saved_us_per_record': (documents_ms - raw_ms) * 1000 / max(len(payload), 1),
+                'same_output': payload == raw_payload,
+            }
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the API and measure throughput and latency per route.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--scale', type=int, default=10000, help='employees to seed (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--output', help='JSON report path (default: stdout)')
+    parser.add_argument('--encoding', type=int, metavar='LOANS', help='only time the JSON encoding of a LOANS long list_loans payload')
+    parser.add_argument('--reads', type=int, metavar='RECORDS', help='only time the Document and raw read paths on RECORDS documents per collection')
+    args = parser.parse_args()
+
+    if args.encoding:
+        report = json.dumps(encoding_benchmark(args.encoding), indent=2)
+
+    elif args.reads:
+        report = json.dumps(read_benchmark(args.reads), indent=2)
+
+    else:
+        if not args.skip_seed:
+            seed_database(args.url, args.scale, args.clients, args.seed)
+
+        report = json.dumps(run(args.url, args.scale, args.clients, args.duration, args.seed), indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Thread safe LRU cache whose entries expire ttl seconds after being set
+class LRUCache:
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+
+                self.misses = self.misses + 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            # Drop the least recently used entries
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+        }
@@ -61,36 +61,27 @@ def get_random_hiring_date():
 # from employees import populate_employees
 # populate_employees
 def populate_employees():
-    ids = []
+    # Unique ids without searching the ones already drawn
+    ids = random.sample(range(1000000000, 1130000001), len(names))
     headers = {
             'Content-Type': 'application/json'
         }
 
-    for i in range(len(names)):
-        identification = random.randint(1000000000, 1130000000)
-
-        passed = True
-        while passed:
-            if identification not in ids:
-                ids.append(identification)
-                passed = False
-            else:
-                identification = random.randint(1000000000, 1130000000)
-
-        data = {
-            "data": {
-                "identification": identification,
-                "name": names[i],
-                "hiring_date": get_random_hiring_date(),
-                "birthdate": get_random_birthdate(),
-                "company": companies[i],
-            }
-        }
-
-        response = requests.post(
-            url='http://127.0.0.1:5000/employee/',
-            data=json.dumps(data),
-            headers=headers
-        )
-
-        print(response.content)
+    employees = []
+    for i, identification in enumerate(ids):
+        employees.append({
+            "identification": identification,
+            "name": names[i],
+            "hiring_date": get_random_hiring_date(),
+            "birthdate": get_random_birthdate(),
+            "company": companies[i],
+        })
+
+    # One request for the whole list
+    response = requests.post(
+        url='http://127.0.0.1:5000/employees/bulk',
+        data=json.dumps({"data": employees}),
+        headers=headers
+    )
+
+    print(response.content)
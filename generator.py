@@ -0,0 +1,133 @@
+import datetime
+import re
+
+import numpy
+from bson import ObjectId
+
+from inputs import names, companies
+
+# Synthetic datasets built from inputs.names and inputs.companies. Every
+# column is drawn at once with numpy from a seeded generator, so the same
+# seed always yields the same data (ids included).
+
+first_names = sorted({name.split()[0] for name in names})
+last_names = sorted({name.split()[-1] for name in names})
+company_suffixes = ['S.A.S.', 'S.A.', 'Ltda.', '& Cía.', 'Group']
+streets = ['Calle', 'Carrera', 'Avenida', 'Diagonal', 'Transversal']
+
+# Fixed creation time for generated ObjectIds
+epoch = int(datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+
+# Unique, reproducible ObjectIds: fixed timestamp, seed, kind and a counter
+def object_ids(seed, kind, size):
+    raw = numpy.zeros((size, 12), dtype=numpy.uint8)
+    raw[:, 0:4] = numpy.frombuffer(epoch.to_bytes(4, 'big'), dtype=numpy.uint8)
+    raw[:, 4:8] = numpy.frombuffer((seed % 2 ** 32).to_bytes(4, 'big'), dtype=numpy.uint8)
+    raw[:, 8] = kind
+
+    counter = numpy.arange(size, dtype='>u4').view(numpy.uint8).reshape(size, 4)
+    raw[:, 9:12] = counter[:, 1:4]
+
+    data = raw.tobytes()
+    return [ObjectId(data[index:index + 12]) for index in range(0, len(data), 12)]
+
+
+# Days between first and last (numpy datetime64[D]), uniformly at random
+def random_dates(rng, size, first, last):
+    first = numpy.datetime64(first, 'D')
+    last = numpy.datetime64(last, 'D')
+
+    return first + rng.integers(0, (last - first).astype(int) + 1, size=size)
+
+
+def random_names(rng, size):
+    return numpy.char.add(
+        numpy.char.add(rng.choice(first_names, size=size), ' '),
+        rng.choice(last_names, size=size),
+    )
+
+
+# Well formed NITs of inputs.companies (it has malformed ones too)
+known_nits = [nit for nit in companies if re.fullmatch('[0-9]{9}', nit)]
+
+
+# inputs.companies first, then unique synthetic NITs outside their range
+def company_columns(rng, size):
+    known = numpy.asarray(known_nits[:size], dtype=str)
+    synthetic = 700000000 + rng.choice(100000000, size=size - len(known), replace=False)
+    nits = numpy.concatenate([known, synthetic.astype(str)])
+
+    company_names = numpy.char.add(
+        numpy.char.add(rng.choice(last_names, size=size), ' '),
+        rng.choice(company_suffixes, size=size),
+    )
+
+    addresses = [
+        f'{street} {number} # {first}-{second}'
+        for street, number, first, second in zip(
+            rng.choice(streets, size=size).tolist(),
+            rng.integers(1, 200, size=size).tolist(),
+            rng.integers(1, 200, size=size).tolist(),
+            rng.integers(1, 100, size=size).tolist(),
+        )
+    ]
+
+    return {
+        'NIT': nits,
+        'name': company_names,
+        'address': addresses,
+    }
+
+
+# Employees spread over company_count companies (by position)
+def employee_columns(rng, size, company_count):
+    return {
+        'identification': 1000000000 + rng.choice(130000000, size=size, replace=False),
+        'name': random_names(rng, size),
+        'hiring_date': random_dates(rng, size, '2005-01-01', '2022-12-31'),
+        'birthdate': random_dates(rng, size, '1980-01-01', '1995-12-31'),
+        'company': rng.integers(0, company_count, size=size),
+    }
+
+
+# Loans for employees hired on hiring_dates: binomial counts per employee
+# (average loans_per_employee, at most max_loans), started after the hiring
+# date and paid one installment every 30 days since
+def loan_columns(rng, hiring_dates, loans_per_employee, max_loans, today):
+    today = numpy.datetime64(today, 'D')
+    counts = rng.binomial(max_loans, min(loans_per_employee / max_loans, 1), size=len(hiring_dates))
+
+    employees = numpy.repeat(numpy.arange(len(hiring_dates)), counts)
+    size = len(employees)
+
+    values = rng.integers(1, 51, size=size) * 100000.0
+    installments = rng.choice([6, 12, 24, 36], size=size)
+
+    hired = hiring_dates[employees]
+    start_dates = hired + (rng.random(size) * (today - hired).astype(int)).astype(int)
+    end_dates = start_dates + installments * 30
+
+    installments_paid = numpy.minimum((today - start_dates).astype(int) // 30, installments)
+    total_paid = values / installments * installments_paid
+
+    return counts, {
+        'employee': employees,
+        'value': values,
+        'installments': installments,
+        'installments_paid': installments_paid,
+        'total_paid': total_paid,
+        'total_left': values - total_paid,
+        'start_date': start_dates,
+        'end_date': end_dates,
+    }
+
+
+# Column values as Python objects (datetime64 becomes datetime.datetime)
+def values(column):
+    column = numpy.asarray(column)
+
+    if numpy.issubdtype(column.dtype, numpy.datetime64):
+        column = column.astype('datetime64[ms]')
+
+    return column.tolist()
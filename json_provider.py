@@ -0,0 +1,90 @@
+import datetime
+import decimal
+import functools
+import uuid
+
+from bson import ObjectId, json_util
+from flask.json.provider import DefaultJSONProvider
+from mongoengine.base import BaseDocument
+from mongoengine.queryset import QuerySet
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Dates render as HTTP dates, like Flask's default provider. Serialized
+# payloads repeat the same few thousand dates, so the strings are cached.
+cached_http_date = functools.lru_cache(maxsize=65536)(http_date)
+
+
+# Anything else (None, or the strings of a Document built from request
+# data) passes through as the encoder would output it
+def json_date(value):
+    return cached_http_date(value) if isinstance(value, datetime.date) else value
+
+
+# Values the JSON libraries can't encode on their own
+def default(value):
+    if isinstance(value, datetime.date):
+        return json_date(value)
+
+    if isinstance(value, (ObjectId, decimal.Decimal, uuid.UUID)):
+        return str(value)
+
+    # Documents and querysets, as flask_mongoengine encodes them
+    if isinstance(value, BaseDocument):
+        return json_util._json_convert(value.to_mongo())
+
+    if isinstance(value, QuerySet):
+        return json_util._json_convert(value.as_pymongo())
+
+    # numpy / pandas scalars
+    if hasattr(value, 'item'):
+        return value.item()
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# orjson backed provider with the output of Flask's default one: sorted
+# keys, HTTP dates, indented in debug mode. Calls with options orjson has
+# no equivalent for fall back to the standard library.
+class FastJSONProvider(DefaultJSONProvider):
+
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def encode(self, obj, indent=None):
+        options = self.options | orjson.OPT_INDENT_2 if indent else self.options
+        return orjson.dumps(obj, default=default, option=options)
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+
+        return self.encode(obj, kwargs.get('indent')).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+
+        return self._app.response_class(self.encode(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+# JSON_PROVIDER: 'orjson' (the default when it is installed) or 'json' for
+# Flask's own provider
+def init_app(app, name=None):
+    if name == 'json' or (name is None and orjson is None):
+        return
+
+    if orjson is None:
+        raise RuntimeError('JSON_PROVIDER=orjson needs the orjson package.')
+
+    app.json = FastJSONProvider(app)
@@ -0,0 +1,109 @@
+import atexit
+import datetime
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+from flask.logging import default_handler
+
+
+# Keeps a fraction of the records below WARNING; warnings and errors always pass
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+# Hands records to the background listener. Only cheap work happens in the
+# calling thread: the message, the traceback text and the request fields.
+class BackgroundHandler(QueueHandler):
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+
+        # Encoded now: the request may still change the payload afterwards
+        if hasattr(record, 'payload'):
+            record.payload = json.dumps(record.payload, default=str)
+
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+
+        return record
+
+
+# One JSON object per line
+class JsonFormatter(logging.Formatter):
+
+    fields = ('method', 'path')
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        for field in self.fields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        line = json.dumps(entry, default=str)
+
+        # Payloads arrive already encoded by BackgroundHandler
+        if hasattr(record, 'payload'):
+            line = line[:-1] + ', "payload": ' + record.payload + '}'
+
+        return line
+
+
+# Parses 'app.payloads=0.01,slow_queries=0.5' into {logger: rate}
+def parse_sampling(value):
+    rates = {}
+
+    for item in (value or '').split(','):
+        if item.strip():
+            name, rate = item.split('=')
+            rates[name.strip()] = float(rate)
+
+    return rates
+
+
+# Routes every logger through a queue drained by a background thread, so
+# request threads never wait on log output
+def init_app(app, level='INFO', sampling=None):
+    records = queue.Queue(-1)
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter())
+
+    listener = QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [BackgroundHandler(records)]
+    root.setLevel(level)
+
+    app.logger.removeHandler(default_handler)
+
+    for name, rate in (sampling or {}).items():
+        logging.getLogger(name).addFilter(SamplingFilter(rate))
+
+    return listener
@@ -0,0 +1,143 @@
+import time
+
+from flask import g, request
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+
+# Request metrics, labeled by the route template (not the raw path)
+request_latency = Histogram(
+    'http_request_duration_seconds',
+    'Request latency in seconds.',
+    ['method', 'route'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+request_count = Counter(
+    'http_requests_total',
+    'Requests by status code.',
+    ['method', 'route', 'status'],
+)
+request_size = Histogram(
+    'http_request_size_bytes',
+    'Request body size in bytes.',
+    ['method', 'route'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+response_size = Histogram(
+    'http_response_size_bytes',
+    'Response body size in bytes.',
+    ['method', 'route'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+requests_in_flight = Gauge(
+    'http_requests_in_flight',
+    'Requests being served.',
+    ['method', 'route'],
+)
+
+
+# Database command metrics, fed by monitoring.CommandMonitor
+command_latency = Histogram(
+    'mongodb_command_duration_seconds',
+    'MongoDB command latency in seconds.',
+    ['command'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+command_count = Counter(
+    'mongodb_commands_total',
+    'MongoDB commands by outcome.',
+    ['command', 'status'],
+)
+request_commands = Histogram(
+    'http_request_db_commands',
+    'MongoDB commands issued per request.',
+    ['method', 'route'],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100, 250),
+)
+query_budget_exceeded = Counter(
+    'http_request_query_budget_exceeded_total',
+    'Requests that issued more MongoDB commands than the query budget.',
+    ['method', 'route'],
+)
+
+
+def observe_command(command, seconds, succeeded):
+    command_latency.labels(command).observe(seconds)
+    command_count.labels(command, 'success' if succeeded else 'failure').inc()
+
+
+def observe_request_commands(commands, over_budget):
+    labels = g.get('metrics_labels')
+
+    if labels:
+        request_commands.labels(*labels).observe(commands.count)
+        if over_budget:
+            query_budget_exceeded.labels(*labels).inc()
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_labels = (request.method, route_label())
+    requests_in_flight.labels(*g.metrics_labels).inc()
+
+
+def record(labels, start, status, response=None):
+    request_latency.labels(*labels).observe(time.perf_counter() - start)
+    request_count.labels(*labels, status).inc()
+    request_size.labels(*labels).observe(request.content_length or 0)
+
+    # Streamed responses have no length
+    if response is not None and response.content_length is not None:
+        response_size.labels(*labels).observe(response.content_length)
+
+
+def after_request(response):
+    start = g.pop('metrics_start', None)
+
+    if start is not None:
+        record(g.metrics_labels, start, response.status_code, response)
+
+    return response
+
+
+def teardown_request(exception):
+    labels = g.pop('metrics_labels', None)
+
+    if labels:
+        # Still set when after_request did not run
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            record(labels, start, 500)
+
+        requests_in_flight.labels(*labels).dec()
+
+
+# Exports counters kept elsewhere (caches, connection pool) as gauges
+class StatsCollector:
+
+    def __init__(self, name, documentation, stats):
+        self.name = name
+        self.documentation = documentation
+        self.stats = stats
+
+    def collect(self):
+        metric = GaugeMetricFamily(self.name, self.documentation, labels=['stat'])
+
+        for stat, value in self.stats().items():
+            metric.add_metric([stat], value)
+
+        yield metric
+
+
+def register_stats(name, documentation, stats):
+    REGISTRY.register(StatsCollector(name, documentation, stats))
+
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
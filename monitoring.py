@@ -0,0 +1,341 @@
+import datetime
+import logging
+import queue
+import random
+import threading
+from collections import Counter, deque
+
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+
+# Connection pool counters, fed by pymongo's connection pool events
+class PoolMonitor(monitoring.ConnectionPoolListener):
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.check_out_failures = 0
+        self.pools_cleared = 0
+        self._lock = threading.Lock()
+
+    def _add(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                setattr(self, name, getattr(self, name) + change)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'created': self.created,
+                'open': self.created - self.closed,
+                'checked_out': self.checked_out,
+                'waiting': self.waiting,
+                'check_out_failures': self.check_out_failures,
+                'pools_cleared': self.pools_cleared,
+            }
+
+    def connection_created(self, event):
+        self._add(created=1)
+
+    def connection_closed(self, event):
+        self._add(closed=1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, check_out_failures=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def pool_cleared(self, event):
+        self._add(pools_cleared=1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+# Commands issued while serving one request
+class RequestCommands:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+        self.documents = 0
+        self.shapes = Counter()
+        self.pending = {}
+
+    def most_repeated(self):
+        return self.shapes.most_common(1)[0] if self.shapes else ((None, None), 0)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# Documents returned by a command reply
+def returned_documents(reply):
+    cursor = reply.get('cursor')
+    if cursor:
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+
+    # findAndModify
+    if 'value' in reply:
+        return 1 if reply['value'] else 0
+
+    return 0
+
+
+# Counts MongoDB commands, their duration and the documents they return,
+# attributed to the Flask request (if any) running in the issuing thread
+class CommandMonitor(monitoring.CommandListener):
+
+    def __init__(self, observe=None):
+        self.observe = observe
+
+    def request_commands(self):
+        if not has_request_context():
+            return None
+
+        commands = g.get('db_commands')
+        if commands is None:
+            commands = g.db_commands = RequestCommands()
+
+        return commands
+
+    def started(self, event):
+        commands = self.request_commands()
+
+        if commands is not None:
+            collection = event.command.get(event.command_name)
+            commands.pending[event.request_id] = (event.command_name, collection if isinstance(collection, str) else None)
+
+    def succeeded(self, event):
+        self._record(event, returned_documents(event.reply), True)
+
+    def failed(self, event):
+        self._record(event, 0, False)
+
+    def _record(self, event, documents, succeeded):
+        seconds = event.duration_micros / 1000000
+
+        if self.observe:
+            self.observe(event.command_name, seconds, succeeded)
+
+        commands = self.request_commands()
+
+        if commands is not None:
+            commands.count = commands.count + 1
+            commands.seconds = commands.seconds + seconds
+            commands.documents = commands.documents + documents
+            commands.shapes[commands.pending.pop(event.request_id, (event.command_name, None))] += 1
+
+
+# Per request reporting: debug headers, metrics and the query budget.
+# DB_QUERY_BUDGET (0 disables it) caps the commands per request and
+# DB_REPEATED_QUERY_LIMIT flags the same command on the same collection
+# issued many times, the usual sign of an N+1 pattern.
+def init_app(app, observe_request=None):
+
+    def after_request(response):
+        commands = g.get('db_commands')
+
+        if commands is None:
+            return response
+
+        if app.debug or app.config.get('DB_QUERY_HEADERS'):
+            response.headers['X-DB-Commands'] = str(commands.count)
+            response.headers['X-DB-Time-Ms'] = f'{commands.seconds * 1000:.3f}'
+            response.headers['X-DB-Documents'] = str(commands.documents)
+
+        problems = []
+
+        budget = app.config.get('DB_QUERY_BUDGET')
+        if budget and commands.count > budget:
+            problems.append(f'{commands.count} MongoDB commands (budget {budget})')
+
+        (command, collection), repeated = commands.most_repeated()
+        repeated_limit = app.config.get('DB_REPEATED_QUERY_LIMIT')
+        if repeated_limit and repeated > repeated_limit:
+            problems.append(f'{repeated} {command} commands on {collection}, possible N+1')
+
+        if observe_request:
+            observe_request(commands, bool(problems))
+
+        if problems:
+            message = f'{request.method} {request.path}: ' + '; '.join(problems)
+
+            if app.config.get('DB_QUERY_BUDGET_STRICT', app.testing):
+                raise QueryBudgetExceeded(message)
+
+            app.logger.warning(message)
+
+        return response
+
+    app.after_request(after_request)
+
+
+# Commands whose filter shape is recorded and which explain() accepts
+explainable_commands = {'find', 'aggregate', 'count', 'distinct', 'findAndModify', 'update', 'delete'}
+
+# Command fields that are not part of the operation itself
+session_fields = {'lsid', 'txnNumber', 'readConcern', 'writeConcern', 'autocommit', 'startTransaction'}
+
+
+# Filter shape with every value replaced by '?', keeping field names and operators
+def redact(value):
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+
+    # Lists of conditions ($and, $or) or pipeline stages keep their shape
+    if isinstance(value, (list, tuple)) and value and all(isinstance(item, dict) for item in value):
+        return [redact(item) for item in value]
+
+    return '?'
+
+
+def command_shape(command_name, command):
+    if command_name == 'find' or command_name == 'count' or command_name == 'distinct':
+        return redact(command.get('filter') or command.get('query') or {})
+
+    if command_name == 'findAndModify':
+        return redact(command.get('query') or {})
+
+    if command_name == 'aggregate':
+        return redact(command.get('pipeline') or [])
+
+    if command_name == 'update' or command_name == 'delete':
+        statements = command.get('updates') or command.get('deletes') or []
+        return [redact(statement.get('q') or {}) for statement in statements[:1]]
+
+    return None
+
+
+# Stages of an explain() plan, e.g. {'IXSCAN', 'FETCH'}
+def plan_stages(plan, stages=None):
+    stages = set() if stages is None else stages
+
+    if isinstance(plan, dict):
+        if isinstance(plan.get('stage'), str):
+            stages.add(plan['stage'])
+
+        for key, value in plan.items():
+            # Rejected plans were not executed
+            if key != 'rejectedPlans':
+                plan_stages(value, stages)
+
+    elif isinstance(plan, list):
+        for value in plan:
+            plan_stages(value, stages)
+
+    return stages
+
+
+# Records commands slower than threshold_ms in a bounded ring buffer and
+# explains a sample of them in a background thread to flag collection scans.
+# explain(database, command) runs the explain command and returns its plan.
+class SlowQueryLog(monitoring.CommandListener):
+
+    def __init__(self, threshold_ms=100, size=200, explain=None, explain_sample=0.1, logger=None):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_sample = explain_sample
+        self.logger = logger or logging.getLogger('slow_queries')
+        self.entries = deque(maxlen=size)
+        self._pending = {}
+        self._explains = queue.Queue(maxsize=100)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in explainable_commands and self.threshold_ms is not None:
+            with self._lock:
+                self._pending[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+
+        duration_ms = event.duration_micros / 1000
+
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+
+        database, command = pending
+        entry = {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'command': event.command_name,
+            'collection': command.get(event.command_name),
+            'shape': command_shape(event.command_name, command),
+            'duration_ms': duration_ms,
+            'endpoint': f'{request.method} {request.url_rule.rule if request.url_rule else request.path}' if has_request_context() else None,
+            'plan': None,
+            'collscan': None,
+        }
+
+        with self._lock:
+            self.entries.append(entry)
+
+        self.logger.warning('slow %s on %s took %.1fms from %s: %s', entry['command'], entry['collection'], duration_ms, entry['endpoint'], entry['shape'])
+
+        if self.explain and random.random() < self.explain_sample:
+            self._schedule_explain(entry, database, command)
+
+    # Explains run on their own thread: listeners must not issue commands
+    def _schedule_explain(self, entry, database, command):
+        command = {key: value for key, value in command.items() if not key.startswith('$') and key not in session_fields}
+
+        try:
+            self._explains.put_nowait((entry, database, command))
+        except queue.Full:
+            return
+
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._explain_worker, name='slow-query-explain', daemon=True)
+                self._worker.start()
+
+    def _explain_worker(self):
+        while True:
+            entry, database, command = self._explains.get()
+
+            try:
+                stages = plan_stages(self.explain(database, command))
+                entry['plan'] = sorted(stages)
+                entry['collscan'] = 'COLLSCAN' in stages
+
+                if entry['collscan']:
+                    self.logger.warning('COLLSCAN for %s on %s from %s: %s', entry['command'], entry['collection'], entry['endpoint'], entry['shape'])
+
+            except Exception as err:
+                self.logger.info('explain failed for %s on %s: %s', entry['command'], entry['collection'], err)
+
+    def recent(self):
+        with self._lock:
+            return list(reversed(self.entries))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
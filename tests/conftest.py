@@ -0,0 +1,71 @@
+import os
+import sys
+
+import mongoengine.connection
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def mongod_available(host):
+    try:
+        MongoClient(host, serverSelectionTimeoutMS=500).admin.command('ping')
+        return True
+
+    except PyMongoError:
+        return False
+
+
+# Tests use the mongod at TEST_MONGODB_HOST when one answers, and an in
+# memory MongoDB (mongomock, see requirements-dev.txt) otherwise; tests
+# that need a real server are skipped then
+mongod_host = os.getenv('TEST_MONGODB_HOST', 'localhost')
+mongod = mongod_available(mongod_host)
+
+if mongod:
+    os.environ['MONGODB_HOST'] = mongod_host
+    os.environ['MONGODB_DB'] = os.getenv('TEST_MONGODB_DB', 'company_api_test')
+
+elif mongomock:
+    mongoengine.connection.MongoClient = mongomock.MongoClient
+
+    # pymongo 4.11+ passes sort to bulk updates, which mongomock doesn't take
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+
+    mongomock.collection.BulkOperationBuilder.add_update = add_update_without_sort
+
+import app as api
+
+
+# Empty collections and cache, with one company
+@pytest.fixture
+def reset_database():
+    if not mongod and mongomock is None:
+        pytest.skip('needs a mongod (TEST_MONGODB_HOST) or mongomock')
+
+    api.app.config['TESTING'] = True
+
+    def reset():
+        for model in (api.Loan, api.Employee, api.Company):
+            model.drop_collection()
+
+        api.company_cache.clear()
+        api.app.test_client().post('/company/', json={'NIT': '900786567', 'name': 'Company', 'address': 'Address'})
+
+    return reset
+
+
+@pytest.fixture
+def client(reset_database):
+    reset_database()
+    return api.app.test_client()
@@ -0,0 +1,95 @@
+import datetime
+
+import numpy
+
+import amortization
+import app as api
+from test_loans import loan_id, new_employee, new_loan, pay  # noqa: F401
+
+
+def test_schedules_plan():
+    rows = amortization.schedules([900, 100], [3, 2], ['2025-01-01', '2025-02-01'])
+
+    assert rows['loan'].tolist() == [0, 0, 0, 1, 1]
+    assert rows['installment'].tolist() == [1, 2, 3, 1, 2]
+    assert rows['due_date'].tolist() == [
+        datetime.date(2025, 1, 31), datetime.date(2025, 3, 2), datetime.date(2025, 4, 1),
+        datetime.date(2025, 3, 3), datetime.date(2025, 4, 2),
+    ]
+    assert rows['amount_due'].tolist() == [300, 300, 300, 50, 50]
+    assert rows['cumulative_due'].tolist() == [300, 600, 900, 50, 100]
+    assert rows['remaining_balance'].tolist() == [900, 900, 900, 100, 100]
+    assert not rows['paid'].any()
+
+
+# The last installment settles the loan exactly
+def test_schedules_last_installment():
+    rows = amortization.schedules([100], [3], ['2025-01-01'], [100])
+
+    assert rows['cumulative_due'][-1] == 100
+    assert rows['remaining_balance'][-1] == 0
+    assert rows['paid'].all()
+
+
+# Recorded payments cover the installments in order, partly the last one
+def test_schedules_partial_payments():
+    rows = amortization.schedules([1200, 1200], [12, 12], ['2025-01-01', '2025-01-01'], [50, 250])
+
+    assert rows['amount_paid'][:3].tolist() == [50, 0, 0]
+    assert rows['remaining_balance'][:3].tolist() == [1150, 1150, 1150]
+    assert rows['amount_paid'][12:15].tolist() == [100, 100, 50]
+    assert rows['cumulative_paid'][12:15].tolist() == [100, 200, 250]
+    assert rows['remaining_balance'][12:15].tolist() == [1100, 1000, 950]
+    assert rows['paid'][12:15].tolist() == [True, True, False]
+    assert rows['remaining_balance'][-1] == 950
+
+
+def test_schedules_without_installments():
+    rows = amortization.schedules([100, 200], [0, 1], ['2025-01-01', '2025-01-01'])
+
+    assert rows['loan'].tolist() == [1]
+    assert amortization.schedules([], [], [])['installment'].tolist() == []
+
+
+def test_month_bounds():
+    first, last = amortization.month_bounds('2024-12')
+
+    assert (first, last) == (numpy.datetime64('2024-12-01'), numpy.datetime64('2025-01-01'))
+
+
+def test_dues_in_month():
+    rows = amortization.schedules([900, 100], [3, 2], ['2025-01-01', '2025-02-01'], [300, 0])
+
+    dues = amortization.records(amortization.dues(rows, *amortization.month_bounds('2025-03')))
+
+    assert [(due['loan'], due['installment'], due['due_date'], due['paid']) for due in dues] == [
+        (0, 2, datetime.date(2025, 3, 2), False),
+        (1, 1, datetime.date(2025, 3, 3), False),
+    ]
+    assert amortization.dues(rows, '2026-01-01', '2026-02-01')['loan'].tolist() == []
+
+
+# The schedule agrees with the loan after a payment of a custom amount
+def test_loan_schedule_after_payment(client, loan_id):  # noqa: F811
+    loan = pay(client, loan_id, installments=1, amount=50).get_json()['loan_data']
+
+    schedule = client.get(f'/loan/{loan_id}/schedule').get_json()['schedule']
+
+    assert (schedule[0]['amount_paid'], schedule[0]['paid']) == (50, False)
+    assert schedule[0]['remaining_balance'] == loan['payable_amount'] == 1150
+    assert schedule[-1]['remaining_balance'] == 1150
+
+
+def test_loan_dues_amount_paid(client, loan_id):  # noqa: F811
+    pay(client, loan_id, installments=1, amount=150)
+    api.Loan.objects(id=loan_id).update_one(
+        set__start_date=datetime.date(2025, 1, 1), set__end_date=datetime.date(2025, 12, 27),
+    )
+
+    response = client.get('/loans/dues', query_string={'month': '2025-03'})
+    dues = response.get_json()
+
+    assert response.status_code == 200
+    assert [(due['installment'], due['amount_paid']) for due in dues['dues']] == [(2, 50)]
+    assert (dues['amount_due'], dues['amount_paid']) == (100, 50)
+    assert client.get('/loans/dues', query_string={'month': 'bad'}).status_code == 400
@@ -0,0 +1,145 @@
+import pytest
+
+import app as api
+from conftest import mongod
+
+starlette_testclient = pytest.importorskip('starlette.testclient')
+
+import asgi
+
+# The ASGI handlers must answer exactly like the Flask views they mirror.
+# They use the async driver, so these tests need a real mongod.
+
+pytestmark = pytest.mark.skipif(not mongod, reason='needs a mongod (TEST_MONGODB_HOST)')
+
+
+@pytest.fixture
+def servers(reset_database):
+    with starlette_testclient.TestClient(asgi.application) as async_client:
+        yield reset_database, api.app.test_client(), async_client
+
+
+# Two employees of the company, the first with a loan; returns the loan id
+def seed(client):
+    for identification in (1000, 1001):
+        client.post('/employee/', json={'data': {
+            'identification': identification, 'name': f'Name {identification}', 'hiring_date': '2015/01/02',
+            'birthdate': '1990/03/04', 'company': '900786567',
+        }})
+
+    response = client.post('/loan/', json={'data': {'employee': 1000, 'value': 1200, 'installments': 12}})
+    return response.get_json()['loan_data']['id']
+
+
+def flask_json(response):
+    return response.get_json() if response.is_json else response.get_data(as_text=True)
+
+
+def asgi_json(response):
+    return response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
+
+
+# Generated ids differ between two runs of the same write
+def without_ids(value):
+    if isinstance(value, dict):
+        return {key: without_ids(item) for key, item in value.items() if key not in ('id', 'next_cursor')}
+
+    if isinstance(value, list):
+        return [without_ids(item) for item in value]
+
+    return value
+
+
+reads = [
+    '/companies/',
+    '/companies/?fields=name',
+    '/company/900786567',
+    '/company/900786567?fields=NIT',
+    '/company/123',
+    '/employees/',
+    '/employees/?limit=1',
+    '/employees/?fields=name,company.NIT',
+    '/employees/?stream=1',
+    '/employee/1000',
+    '/employee/1000?fields=name,company',
+    '/employee/9',
+    '/employee/1000/company',
+    '/employee/1000/age',
+    '/employee/1000/loans',
+    '/employee/9/loans',
+    '/loans/',
+    '/loans/?fields=payable_amount,employee.name',
+    '/loans/?after=bad',
+    '/loan/{loan}',
+    '/loan/{loan}?fields=value,employee.identification',
+    '/loan/zz',
+    '/loan/6ad510d2041ce38257fbb7b0',
+]
+
+
+@pytest.mark.parametrize('path', reads)
+def test_reads_match_flask(servers, path):
+    reset, flask_client, async_client = servers
+    reset()
+    path = path.format(loan=seed(flask_client))
+
+    expected = flask_client.get(path)
+    response = async_client.get(path)
+
+    assert response.status_code == expected.status_code
+    assert asgi_json(response) == flask_json(expected)
+    assert response.headers.get('etag') == expected.headers.get('ETag')
+
+    # Conditional requests with the ETag of the other server
+    if expected.headers.get('ETag'):
+        headers = {'If-None-Match': expected.headers['ETag']}
+        assert async_client.get(path, headers=headers).status_code == 304
+        assert flask_client.get(path, headers=headers).status_code == 304
+
+
+writes = [
+    ('/company/', {'NIT': '901556083', 'name': 'Other', 'address': 'Address'}),
+    ('/company/', {'NIT': '900786567', 'name': 'Other', 'address': 'Address'}),
+    ('/company/', {'NIT': '12', 'name': 'Other', 'address': 'Address'}),
+    ('/company/900786567', {'name': 'Other'}),
+    ('/company/123', {'name': 'Other'}),
+    ('/company/900786567/delete', None),
+    ('/employee/', {'data': {
+        'identification': 1002, 'name': 'Other', 'hiring_date': '2016/01/02',
+        'birthdate': '1991/03/04', 'company': '900786567',
+    }}),
+    ('/employee/', {'data': {
+        'identification': 1000, 'name': 'Other', 'hiring_date': '2016/01/02',
+        'birthdate': '1991/03/04', 'company': '900786567',
+    }}),
+    ('/employee/1000', {'data': {'name': 'Other', 'hiring_date': '2016/01/02'}}),
+    ('/employee/9', {'data': {'name': 'Other'}}),
+    ('/employee/1001/delete', None),
+    ('/employee/9/delete', None),
+    ('/loan/', {'data': {'employee': 1001, 'value': 600, 'installments': 6}}),
+    ('/loan/', {'data': {'employee': 9, 'value': 600, 'installments': 6}}),
+    ('/loan/{loan}', {'data': {'installments': 1}}),
+    ('/loan/{loan}', {'data': {'installments': 1, 'amount': 50}}),
+    ('/loan/zz', {'data': {'installments': 1}}),
+    ('/loan/{loan}/delete', None),
+    ('/loan/6ad510d2041ce38257fbb7b0/delete', None),
+]
+
+
+@pytest.mark.parametrize('path, body', writes)
+def test_writes_match_flask(servers, path, body):
+    reset, flask_client, async_client = servers
+    outcomes = []
+
+    # The same write on the same data, through each server
+    for post, as_json in ((flask_client.post, flask_json), (async_client.post, asgi_json)):
+        reset()
+        loan_path = path.format(loan=seed(flask_client))
+
+        response = post(loan_path, json=body) if body is not None else post(loan_path)
+        body_json = as_json(response)
+
+        state = [flask_client.get(list_path).get_json() for list_path in ('/companies/', '/employees/', '/loans/')]
+        outcomes.append((response.status_code, without_ids(body_json), without_ids(state)))
+
+    assert outcomes[1] == outcomes[0]
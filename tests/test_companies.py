@@ -0,0 +1,24 @@
+# One malformed NIT only fails its own row, digits of other scripts included
+def test_bulk_rejects_non_ascii_nits(client):
+    response = client.post('/companies/bulk', json={'data': [
+        {'NIT': '901556083', 'name': 'Company', 'address': 'Address'},
+        {'NIT': '٩٠٠١٢٣٤٥٦', 'name': 'Company', 'address': 'Address'},
+    ]})
+
+    results = response.get_json()['results']
+
+    assert response.status_code == 200
+    assert results[0]['verification_digit'] == 7
+    assert results[1]['result'] == 'Error: Company NIT not valid.'
+
+
+def test_bulk_rejects_invalid_fields(client):
+    response = client.post('/companies/bulk', json={'data': [
+        {'NIT': '901556083', 'name': 'Company', 'address': 5},
+        {'NIT': '800011292', 'name': 'x' * 257, 'address': 'Address'},
+    ]})
+
+    results = response.get_json()['results']
+
+    assert response.status_code == 200
+    assert [result['result'] for result in results] == ['Error: Company data not valid.'] * 2
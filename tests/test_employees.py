@@ -0,0 +1,57 @@
+import app as api
+
+
+def new_employee(client):
+    return client.post('/employee/', json={'data': {
+        'identification': 1000, 'name': 'Name', 'hiring_date': '2015/01/02',
+        'birthdate': '1990/03/04', 'company': '900786567',
+    }})
+
+
+# Employees built from request data hold their dates as strings
+def test_create_employee(client):
+    response = new_employee(client)
+
+    assert response.status_code == 200
+    assert response.get_json()['employee_data']['hiring_date'] == 'Fri, 02 Jan 2015 00:00:00 GMT'
+
+
+def test_update_employee(client):
+    new_employee(client)
+    response = client.post('/employee/1000', json={'data': {'name': 'Other', 'hiring_date': '2016/01/02'}})
+
+    assert response.status_code == 200
+    assert response.get_json()['employee_data']['name'] == 'Other'
+    assert response.get_json()['employee_data']['hiring_date'] == 'Sat, 02 Jan 2016 00:00:00 GMT'
+    assert client.get('/employee/1000').get_json()['hiring_date'] == 'Sat, 02 Jan 2016 00:00:00 GMT'
+
+
+def test_bulk_rejects_invalid_rows(client):
+    response = client.post('/employees/bulk', json={'data': [
+        {'identification': 1000, 'name': 'Name', 'hiring_date': '2015/01/02', 'birthdate': '1990/03/04', 'company': '900786567'},
+        {'identification': 1001, 'name': ['x', 'y'], 'hiring_date': '2015/01/02', 'birthdate': '1990/03/04', 'company': '900786567'},
+    ]})
+
+    results = response.get_json()['results']
+
+    assert response.status_code == 200
+    assert results[0]['result'] == 'Employee created successfully.'
+    assert results[1]['result'] == 'Error: Employee data not valid.'
+    assert client.get('/employee/1001').status_code == 400
+
+
+# Saves increment the stored version, so they can't reuse one a loan produced
+def test_update_keeps_etags_unique(client):
+    new_employee(client)
+    employee = api.Employee.objects.get(identification=1000)
+
+    client.post('/loan/', json={'data': {'employee': 1000, 'value': 1200, 'installments': 12}})
+    etag = client.get('/employee/1000').headers['ETag']
+
+    employee.name = 'Other'
+    employee.save()
+
+    response = client.get('/employee/1000', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Other'
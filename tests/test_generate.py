@@ -0,0 +1,21 @@
+import app as api
+
+
+def generated_documents(client, today):
+    result = api.app.test_cli_runner().invoke(args=[
+        'generate', '--companies', '5', '--employees', '50', '--seed', '3', '--today', today, '--drop',
+    ])
+    assert result.exception is None
+
+    return [
+        list(model.objects.order_by('id').as_pymongo())
+        for model in (api.Company, api.Employee, api.Loan)
+    ]
+
+
+# The same seed and date give the same documents, whatever day it runs
+def test_generate_is_reproducible(client):
+    first = generated_documents(client, '2025-01-01')
+
+    assert generated_documents(client, '2025-01-01') == first
+    assert generated_documents(client, '2026-06-01') != first
@@ -0,0 +1,139 @@
+import pytest
+
+import app as api
+
+
+def new_employee(client, identification=1000):
+    return client.post('/employee/', json={'data': {
+        'identification': identification, 'name': 'Name', 'hiring_date': '2015/01/02',
+        'birthdate': '1990/03/04', 'company': '900786567',
+    }})
+
+
+def new_loan(client, employee):
+    return client.post('/loan/', json={'data': {'employee': employee, 'value': 1200, 'installments': 12}})
+
+
+@pytest.fixture
+def loan_id(client):
+    new_employee(client)
+    return new_loan(client, 1000).get_json()['loan_data']['id']
+
+
+def pay(client, loan_id, **payment):
+    return client.post(f'/loan/{loan_id}', json={'data': payment})
+
+
+def test_create_loan_with_string_identification(client):
+    new_employee(client)
+
+    response = new_loan(client, '1000')
+
+    assert response.status_code == 200
+    assert response.get_json()['loan_data']['employee']['current_loans'] == 1
+    assert new_loan(client, 'abc').status_code == 400
+
+
+# delete_employee does not cascade to the employee's loans
+def test_read_loan_of_deleted_employee(client, loan_id):
+    api.Employee.objects(identification=1000).delete()
+
+    response = client.get(f'/loan/{loan_id}')
+
+    assert response.status_code == 200
+    assert response.get_json()['employee'] is None
+    assert client.get(f'/loan/{loan_id}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_payment_with_amount(client, loan_id):
+    response = pay(client, loan_id, installments=1, amount=50)
+    loan = response.get_json()['loan_data']
+
+    assert response.status_code == 200
+    assert (loan['installments_paid'], loan['total_paid'], loan['payable_amount']) == (1, 50, 1150)
+
+
+# Without an amount the installments are priced from the loan
+def test_payment_priced_from_the_loan(client, loan_id):
+    response = pay(client, loan_id, installments=2)
+    loan = response.get_json()['loan_data']
+
+    assert response.status_code == 200
+    assert (loan['installments_paid'], loan['total_paid'], loan['payable_amount']) == (2, 200, 1000)
+
+
+def test_payment_on_a_paid_loan(client, loan_id):
+    assert pay(client, loan_id, installments=12).status_code == 200
+
+    response = pay(client, loan_id, installments=1)
+
+    assert response.status_code == 400
+    assert response.get_json()['result'] == 'Error: Loan is already fully paid.'
+
+
+def test_payment_with_invalid_data(client, loan_id):
+    assert pay(client, 'zz', installments=1).get_json()['result'] == 'Error: Loan ID not valid.'
+    assert pay(client, '6ad510d2041ce38257fbb7b0', installments=1).get_json()['result'] == 'Error: Loan does not exist in the database.'
+    assert pay(client, loan_id, installments=-1).get_json()['result'] == 'Error: Payment data not valid.'
+
+
+def pay_many(client, *payments):
+    return client.post('/loans/payments', json={'data': list(payments)}).get_json()
+
+
+# A payment clearing the loan makes the next one in the batch fail
+def test_batch_payments_on_the_same_loan(client, loan_id):
+    response = pay_many(
+        client,
+        {'loan_id': loan_id, 'installments': 11},
+        {'loan_id': loan_id, 'installments': 1, 'amount': 100},
+        {'loan_id': loan_id, 'installments': 1},
+    )
+
+    assert [result['result'] for result in response['results']] == [
+        'Payment applied successfully.',
+        'Payment applied successfully.',
+        'Error: Loan is already fully paid.',
+    ]
+    assert (response['applied'], response['failed']) == (2, 1)
+    assert client.get(f'/loan/{loan_id}').get_json()['payable_amount'] == 0
+
+
+def test_batch_payments_with_invalid_items(client, loan_id):
+    response = pay_many(
+        client,
+        {'installments': 1},
+        {'loan_id': 5, 'installments': 1},
+        {'loan_id': '6ad510d2041ce38257fbb7b0', 'installments': 1},
+        {'loan_id': loan_id, 'installments': 2},
+    )
+
+    assert [result['result'] for result in response['results']] == [
+        'Error: Payment data not valid.',
+        'Error: Payment data not valid.',
+        'Error: Loan does not exist in the database.',
+        'Payment applied successfully.',
+    ]
+    assert client.get(f'/loan/{loan_id}').get_json()['installments_paid'] == 2
+
+
+# Loans paid off between the read and the write are reported from the write
+def test_batch_payment_on_a_loan_paid_meanwhile(client, loan_id, monkeypatch):
+    find = api.Loan._get_collection().__class__.find
+    calls = []
+
+    def paid_off_after_read(self, *args, **kwargs):
+        result = list(find(self, *args, **kwargs))
+
+        if not calls:
+            calls.append(1)
+            api.Loan.objects(id=loan_id).update_one(set__total_left=0)
+
+        return result
+
+    monkeypatch.setattr(api.Loan._get_collection().__class__, 'find', paid_off_after_read)
+
+    response = pay_many(client, {'loan_id': loan_id, 'installments': 1})
+
+    assert response['results'][0]['result'] == 'Error: Loan is already fully paid.'
+    assert response['applied'] == 0
@@ -0,0 +1,8 @@
+from prometheus_client import CONTENT_TYPE_LATEST
+
+
+def test_metrics_content_type(client):
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == CONTENT_TYPE_LATEST